@@ -1,26 +1,48 @@
 import os
 import re
+import io
 import json
-import tempfile
 import time
+import http.cookiejar
+import heapq
+import queue
 import threading
+import atexit
 import base64
+import shutil
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime, timedelta
-from urllib.parse import parse_qs, urlparse
+from types import MappingProxyType
+from collections import OrderedDict
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlsplit
 from flask import Flask, request, abort, send_from_directory
 from dotenv import load_dotenv
-from openai import OpenAI
-import google.generativeai as genai
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from notion_client import Client as NotionClient
+from bs4.dammit import EncodingDetector
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    HTML_PARSER = "html.parser"
+else:
+    # C parser, several times faster than html.parser on large pages
+    HTML_PARSER = "lxml"
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
 from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2.credentials import Credentials as OAuthCredentials
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaInMemoryUpload
 
-from apify_client import ApifyClient
 
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
@@ -29,6 +51,7 @@ from linebot.v3.messaging import (
     ApiClient,
     MessagingApi,
     MessagingApiBlob,
+    ShowLoadingAnimationRequest,
     ReplyMessageRequest,
     PushMessageRequest,
     TextMessage,
@@ -36,6 +59,7 @@ from linebot.v3.messaging import (
     QuickReply,
     QuickReplyItem,
     MessageAction,
+    ApiException,
 )
 from linebot.v3.webhooks import MessageEvent, TextMessageContent, AudioMessageContent, ImageMessageContent
 
@@ -118,91 +142,226 @@ GDRIVE_OAUTH_CLIENT_JSON = normalize_env_value(os.getenv("GDRIVE_OAUTH_CLIENT_JS
 GDRIVE_OAUTH_TOKEN_JSON = normalize_env_value(os.getenv("GDRIVE_OAUTH_TOKEN_JSON"))
 GOOGLE_CALENDAR_IDS = [cid.strip() for cid in os.getenv("GOOGLE_CALENDAR_ID", "primary").split(",") if cid.strip()]
 CRON_SECRET = os.getenv("CRON_SECRET")
+# Transient 429/5xx/connection errors are retried with exponential backoff
+# inside the OpenAI SDK and googleapiclient before surfacing to the user.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+GDRIVE_NUM_RETRIES = int(os.getenv("GDRIVE_NUM_RETRIES", 3))
+# Slow work (LLM calls, scraping, Drive saves) runs here after the webhook has
+# been answered, so LINE deliveries are not held behind each other.
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", 32))
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() not in ("0", "false", "no")
+# Posts from one multi-post scrape are summarized and saved this many at a time
+SCRAPE_SAVE_CONCURRENCY = int(os.getenv("SCRAPE_SAVE_CONCURRENCY", 8))
 
 if not CHANNEL_ACCESS_TOKEN or not CHANNEL_SECRET:
     raise ValueError("Please set LINE_CHANNEL_ACCESS_TOKEN and LINE_CHANNEL_SECRET in .env file")
 
 configuration = Configuration(access_token=CHANNEL_ACCESS_TOKEN)
+# One ApiClient for the process so replies and pushes reuse its urllib3
+# connection pool instead of opening a new TLS connection per message.
+line_api_client = ApiClient(configuration)
+line_messaging_api = MessagingApi(line_api_client)
+line_blob_api = MessagingApiBlob(line_api_client)
 handler = WebhookHandler(CHANNEL_SECRET)
 
 # OpenAI client for Whisper
+# httpx drops idle keep-alive connections after 5s by default; holding them
+# for a minute lets back-to-back messages skip the TCP+TLS handshake.
+# The optional service SDKs below are imported only when their key is set,
+# so an unconfigured service costs nothing at startup (or test collection).
 openai_client = None
 if OPENAI_API_KEY:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+
+    openai_client = OpenAI(
+        api_key=OPENAI_API_KEY,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=128, max_keepalive_connections=64, keepalive_expiry=60),
+        ),
+    )
 
 # Gemini client for text processing
 gemini_model = None
 if GEMINI_API_KEY:
+    import google.generativeai as genai
+
     genai.configure(api_key=GEMINI_API_KEY)
     gemini_model = genai.GenerativeModel('gemini-2.0-flash')
 
+
+def warm_up_clients():
+    """Open the OpenAI connection at boot so the first webhook skips DNS + TLS setup"""
+    if not openai_client:
+        return
+    try:
+        openai_client.models.retrieve("gpt-4.1-mini")
+        print("[DEBUG] OpenAI connection warmed up")
+    except Exception as e:
+        print(f"[DEBUG] OpenAI warm-up failed: {str(e)}")
+
+
+if WARMUP_ON_START:
+    threading.Thread(target=warm_up_clients, daemon=True).start()
+
+
 # Notion client for saving content
 notion_client = None
 if NOTION_API_KEY and NOTION_DATABASE_ID:
+    from notion_client import Client as NotionClient
+
     notion_client = NotionClient(auth=NOTION_API_KEY)
     print("[DEBUG] Notion client initialized")
 
 # Apify client for social media scraping
 apify_client = None
 if APIFY_API_KEY:
+    from apify_client import ApifyClient
+
     apify_client = ApifyClient(APIFY_API_KEY)
     print("[DEBUG] Apify client initialized")
 
-# User states for translation mode (in-memory storage)
+# Shared HTTP session for scraping and LINE content downloads: keeps
+# connections to repeat hosts alive and retries once on connection errors.
+# Cookies are never persisted, so one user's scrape can't leak session state
+# into another's; per-request cookies (e.g. PTT over18) still get sent.
+http_session = requests.Session()
+http_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+_http_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=Retry(total=1, backoff_factor=0.2))
+http_session.mount("https://", _http_adapter)
+http_session.mount("http://", _http_adapter)
+atexit.register(http_session.close)
+
+background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="bg")
+
+# User states for translation / scrape-count modes (in-memory storage)
 # Structure: { user_id: { "mode": "translate", "target_language": "English", "entered_at": timestamp } }
+# Written from webhook handlers and the timeout thread; mutate it under user_states_lock.
+# Every mode times out, so entries do not accumulate for users who walk away.
 user_states = {}
+user_states_lock = threading.Lock()
 
 # Track last saved file per user for "補充想法" feature
 # Structure: { user_id: { "file_id": "...", "title": "...", "saved_at": timestamp } }
 user_last_file = {}
+# Background tasks that will set user_last_file and are still in flight:
+# { user_id: Future }. Entries remove themselves when the task finishes.
+user_pending_last_file = {}
+user_pending_last_file_lock = threading.Lock()
 
 # Translation mode timeout (5 minutes)
 TRANSLATION_MODE_TIMEOUT = 5 * 60  # 5 minutes in seconds
 
 
-def check_translation_timeout():
-    """Background thread to check and handle translation mode timeouts"""
+TRANSLATION_MODES = ("translate_waiting", "translate_select_language")
+TIMED_MODES = TRANSLATION_MODES + ("scrape_waiting_count",)
+
+# Min-heap of (expires_at, user_id) for user mode timeouts. Entries are
+# never removed in place: when a user is active again a new entry is pushed,
+# and stale entries are skipped when they reach the top of the heap.
+_state_timeouts: list[tuple[float, str]] = []
+_state_timeouts_lock = threading.Lock()
+_state_timeouts_changed = threading.Event()
+
+
+def schedule_state_timeout(user_id: str, entered_at: float) -> None:
+    """Register the mode deadline for a user and wake the checker"""
+    with _state_timeouts_lock:
+        heapq.heappush(_state_timeouts, (entered_at + TRANSLATION_MODE_TIMEOUT, user_id))
+    _state_timeouts_changed.set()
+
+
+def set_user_state(user_id: str, state: dict) -> None:
+    """Replace a user's conversation state"""
+    with user_states_lock:
+        user_states[user_id] = state
+
+
+def pop_user_state(user_id: str) -> dict | None:
+    """Remove and return a user's conversation state, if any"""
+    with user_states_lock:
+        return user_states.pop(user_id, None)
+
+
+def enter_user_mode(user_id: str, mode: str, **fields) -> None:
+    """Put a user into a waiting mode (translation, scrape count) and start its timeout"""
+    entered_at = time.time()
+    set_user_state(user_id, {"mode": mode, **fields, "entered_at": entered_at})
+    schedule_state_timeout(user_id, entered_at)
+
+
+def touch_user_mode(user_id: str) -> None:
+    """Reset the mode timeout after user activity"""
+    entered_at = time.time()
+    with user_states_lock:
+        state = user_states.get(user_id)
+        if not state:
+            return
+        state["entered_at"] = entered_at
+    schedule_state_timeout(user_id, entered_at)
+
+
+def expire_user_state(user_id: str, now: float) -> str | None:
+    """Remove a timed out user state and return its mode; None for stale heap entries"""
+    with user_states_lock:
+        state = user_states.get(user_id)
+        if not state or state.get("mode") not in TIMED_MODES:
+            return None
+        if state.get("entered_at", now) + TRANSLATION_MODE_TIMEOUT > now:
+            return None
+        del user_states[user_id]
+        return state["mode"]
+
+
+def check_state_timeouts():
+    """Background thread that expires user modes at their deadline.
+
+    Sleeps until the earliest pending deadline (or indefinitely when nobody is
+    in a waiting mode) instead of scanning all user states on a fixed interval.
+    """
     while True:
+        wait_seconds = None
         try:
-            current_time = time.time()
-            users_to_remove = []
-
-            # Find users who have timed out
-            for user_id, state in list(user_states.items()):
-                if state.get("mode") in ["translate_waiting", "translate_select_language"]:
-                    entered_at = state.get("entered_at", current_time)
-                    if current_time - entered_at >= TRANSLATION_MODE_TIMEOUT:
-                        users_to_remove.append(user_id)
-
-            # Remove timed out users and send notification
-            for user_id in users_to_remove:
-                if user_id in user_states:
-                    del user_states[user_id]
-                    print(f"[DEBUG] User {user_id} translation mode timed out")
-
-                    # Send push message to notify user
-                    try:
-                        with ApiClient(configuration) as api_client:
-                            messaging_api = MessagingApi(api_client)
-                            messaging_api.push_message(
-                                PushMessageRequest(
-                                    to=user_id,
-                                    messages=[TextMessage(text="⏰ 翻譯模式已逾時（5分鐘），已自動退出。\n\n如需繼續翻譯，請重新輸入「翻譯」進入翻譯模式。")]
-                                )
-                            )
-                            print(f"[DEBUG] Timeout notification sent to user {user_id}")
-                    except Exception as e:
-                        print(f"[DEBUG] Failed to send timeout notification: {str(e)}")
+            due_user_ids = []
+            with _state_timeouts_lock:
+                now = time.time()
+                while _state_timeouts and _state_timeouts[0][0] <= now:
+                    due_user_ids.append(heapq.heappop(_state_timeouts)[1])
+                if _state_timeouts:
+                    wait_seconds = _state_timeouts[0][0] - now
+                _state_timeouts_changed.clear()
+
+            for user_id in due_user_ids:
+                expired_mode = expire_user_state(user_id, now)
+                if not expired_mode:
+                    continue
+                print(f"[DEBUG] User {user_id} {expired_mode} mode timed out")
+                if expired_mode not in TRANSLATION_MODES:
+                    continue
+
+                # Send push message to notify user
+                try:
+                    line_messaging_api.push_message(
+                        PushMessageRequest(
+                            to=user_id,
+                            messages=[TextMessage(text="⏰ 翻譯模式已逾時（5分鐘），已自動退出。\n\n如需繼續翻譯，請重新輸入「翻譯」進入翻譯模式。")]
+                        )
+                    )
+                    print(f"[DEBUG] Timeout notification sent to user {user_id}")
+                except Exception as e:
+                    print(f"[DEBUG] Failed to send timeout notification: {str(e)}")
 
         except Exception as e:
             print(f"[DEBUG] Error in timeout checker: {str(e)}")
+            wait_seconds = 30
 
-        # Check every 30 seconds
-        time.sleep(30)
+        # Sleep until the next deadline or until a new timeout is scheduled
+        _state_timeouts_changed.wait(wait_seconds)
 
 
 # Start background thread for timeout checking
-timeout_thread = threading.Thread(target=check_translation_timeout, daemon=True)
+timeout_thread = threading.Thread(target=check_state_timeouts, daemon=True)
 timeout_thread.start()
 
 # URL pattern for detecting links. Keep this permissive because mobile share
@@ -230,6 +389,35 @@ THREADS_PROFILE_PATTERN = re.compile(
     r'https?://(?:www\.)?threads\.(?:net|com)/@[\w.]+/?(?:\?.*)?$',
     re.IGNORECASE,
 )
+# All four social shapes in one alternation, tried in the same order as the
+# individual patterns above; the named group that matched tells platform + type
+SOCIAL_URL_PATTERN = re.compile(
+    "|".join(
+        f"(?P<{name}>{pattern.pattern})"
+        for name, pattern in (
+            ("facebook_post", FACEBOOK_POST_PATTERN),
+            ("facebook_page", FACEBOOK_PAGE_PATTERN),
+            ("threads_post", THREADS_POST_PATTERN),
+            ("threads_page", THREADS_PROFILE_PATTERN),
+        )
+    ),
+    re.IGNORECASE,
+)
+# Google Maps links (maps.google.com, google.com/maps, goo.gl/maps, maps.app.goo.gl)
+GOOGLE_MAPS_PATTERN = re.compile(
+    r'maps\.google\.com|google\.com/maps|goo\.gl/maps|/maps/|maps\.app',
+    re.IGNORECASE,
+)
+
+# Knowledge-base commands, one named alternative each so a single match
+# tells which command (if any) a message is; lastgroup is the command name
+COMMAND_PATTERN = re.compile(
+    r'(?P<query>(?:查|搜尋|找)\s+(?P<keyword>.+))$'
+    r'|(?P<schedule>查行程|行程|今天行程|明天行程|這週行程|下週行程|本週行程)$'
+    r'|(?P<add_event>(?:加行程|新增行程|加入行程|記行程)[：:]\s*(?P<event_text>.+))$'
+    r'|(?P<add_contact>(?:加聯絡人|新增聯絡人|記聯絡人|加人脈)[：:]\s*(?P<contact_text>.+))$'
+    r'|(?P<ask>(?:問|請問)\s+(?P<question>.+))$'
+)
 
 # Command pattern for multi-post scraping: "爬 5 篇 [URL]" or "幫我爬 10 篇 [URL]"
 SCRAPE_MULTI_PATTERN = re.compile(
@@ -244,9 +432,11 @@ TRANSLATE_PATTERN = re.compile(
     r'^(?:幫我|請|請幫我)?翻譯成?\s*(.+?)\s*[：:\s]\s*(.+)$',
     re.DOTALL
 )
+# Every TRANSLATE_PATTERN match starts with one of these; cheap reject for other text
+TRANSLATE_PREFIXES = ("翻譯", "幫我翻譯", "請翻譯", "請幫我翻譯")
 
 # Quick Reply language options for translation mode
-QUICK_REPLY_LANGUAGES = [
+QUICK_REPLY_LANGUAGES = (
     ("英文", "English"),
     ("日文", "Japanese"),
     ("韓文", "Korean"),
@@ -257,10 +447,20 @@ QUICK_REPLY_LANGUAGES = [
     ("法文", "French"),
     ("西班牙文", "Spanish"),
     ("德文", "German"),
-]
+)
+
+# Quick Reply menus are immutable, so they are built once and shared
+LANGUAGE_QUICK_REPLY = QuickReply(items=[
+    *(QuickReplyItem(action=MessageAction(label=label, text=label)) for label, _ in QUICK_REPLY_LANGUAGES),
+    QuickReplyItem(action=MessageAction(label="❌ 取消", text="取消")),
+])
+TRANSLATION_MODE_QUICK_REPLY = QuickReply(items=[
+    QuickReplyItem(action=MessageAction(label="🚪 離開翻譯模式", text="取消")),
+    QuickReplyItem(action=MessageAction(label="🔄 切換語言", text="切換語言")),
+])
 
 # Language name mapping (Chinese name -> language code for OpenAI)
-LANGUAGE_MAP = {
+LANGUAGE_MAP = MappingProxyType({
     # 常用語言
     "英文": "English",
     "英語": "English",
@@ -320,7 +520,7 @@ LANGUAGE_MAP = {
     "瑞典語": "Swedish",
     "希臘文": "Greek",
     "希臘語": "Greek",
-}
+})
 
 CAPTURE_STATUS_FULL = "full"
 CAPTURE_STATUS_PARTIAL = "partial"
@@ -544,10 +744,7 @@ def source_type_from_url(url: str) -> str:
         return "facebook"
     if "youtube.com" in lower or "youtu.be" in lower:
         return "youtube"
-    if any(pattern in lower for pattern in [
-        "maps.google.com", "google.com/maps", "goo.gl/maps",
-        "maps.app.goo.gl", "/maps/", "maps.app"
-    ]):
+    if GOOGLE_MAPS_PATTERN.search(lower):
         return "google_maps"
     if "104.com.tw/job/" in lower:
         return "104"
@@ -925,7 +1122,7 @@ def resolve_short_url(url: str) -> str:
     """Resolve a shortened URL to its final destination URL.
     Returns the original URL if resolution fails."""
     try:
-        response = requests.head(url, allow_redirects=True, timeout=10)
+        response = http_session.head(url, allow_redirects=True, timeout=10)
         final_url = response.url
         if final_url and final_url != url:
             print(f"[DEBUG] Resolved short URL: {url} -> {final_url}")
@@ -949,15 +1146,11 @@ def detect_social_platform(url: str) -> tuple[str | None, str]:
     Returns:
         Tuple of (platform, url_type) where url_type is "post" or "page"
     """
-    if FACEBOOK_POST_PATTERN.match(url):
-        return ("facebook", "post")
-    if FACEBOOK_PAGE_PATTERN.match(url):
-        return ("facebook", "page")
-    if THREADS_POST_PATTERN.match(url):
-        return ("threads", "post")
-    if THREADS_PROFILE_PATTERN.match(url):
-        return ("threads", "page")
-    return (None, "")
+    match = SOCIAL_URL_PATTERN.match(url)
+    if not match:
+        return (None, "")
+    platform, url_type = match.lastgroup.split("_")
+    return (platform, url_type)
 
 
 def scrape_facebook_post(url: str, max_posts: int = 1) -> list[dict]:
@@ -1555,40 +1748,159 @@ def parse_social_summary_response(response: str) -> dict:
     return result
 
 
+# Finished URL summaries, keyed by canonical URL, so a link shared again
+# (e.g. in a group chat) skips the fetch + LLM chain. LRU order, with TTL.
+URL_SUMMARY_CACHE_TTL = int(os.getenv("URL_SUMMARY_CACHE_TTL", 3600))
+URL_SUMMARY_CACHE_MAXSIZE = 1024
+_url_summary_cache: OrderedDict = OrderedDict()
+_url_summary_cache_lock = threading.Lock()
+# Extracted page text from fetch_webpage_content, same scheme with a shorter TTL
+WEBPAGE_CACHE_TTL = int(os.getenv("WEBPAGE_CACHE_TTL", 600))
+WEBPAGE_CACHE_MAXSIZE = 2000
+_webpage_cache: OrderedDict = OrderedDict()
+_webpage_cache_lock = threading.Lock()
+# Share-tracking parameters that do not change the page
+TRACKING_PARAM_PATTERN = re.compile(r'^(?:utm_\w+|fbclid|gclid)$', re.IGNORECASE)
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL for cache lookups (lowercase host, sorted query, no fragment or tracking params)"""
+    parts = urlsplit(url.strip())
+    params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAM_PATTERN.match(k)]
+    query = urlencode(sorted(params))
+    return parts._replace(scheme=parts.scheme.lower(), netloc=parts.netloc.lower(), query=query, fragment="").geturl()
+
+
+def _lru_cache_get(cache: OrderedDict, lock: threading.Lock, key: str):
+    """Return a fresh entry's value (marking it recently used), or None"""
+    with lock:
+        entry = cache.get(key)
+        if not entry:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+
+
+def _lru_cache_put(cache: OrderedDict, lock: threading.Lock, key: str, value, ttl: int, maxsize: int) -> None:
+    """Store a value, evicting the least recently used entries beyond maxsize"""
+    with lock:
+        cache[key] = (time.time() + ttl, value)
+        cache.move_to_end(key)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+
+def get_cached_url_summary(url: str):
+    """Return the cached (summary, extractor, quality) for a URL, if still fresh"""
+    return _lru_cache_get(_url_summary_cache, _url_summary_cache_lock, canonicalize_url(url))
+
+
+def cache_url_summary(url: str, value) -> None:
+    """Store a URL summary, evicting the least recently used entry when full"""
+    _lru_cache_put(
+        _url_summary_cache, _url_summary_cache_lock, canonicalize_url(url), value,
+        URL_SUMMARY_CACHE_TTL, URL_SUMMARY_CACHE_MAXSIZE,
+    )
+
+
+# Direct fetches only read the head of the page: title, meta and the article
+# lead are near the top, and the extracted text is cut to 2000 chars anyway.
+WEBPAGE_FETCH_MAX_BYTES = 512 * 1024
+CHARSET_PATTERN = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+# Lines longer than 20 chars after stripping; shorter ones are menus/buttons
+WEBPAGE_LINE_PATTERN = re.compile(r'^\s*(\S.{19,}\S)\s*$', re.MULTILINE)
+
+
+def read_capped_html(response, max_bytes: int = WEBPAGE_FETCH_MAX_BYTES) -> str:
+    """Read at most max_bytes of a streamed HTML response and decode it"""
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=65536):
+        buf.extend(chunk)
+        if len(buf) >= max_bytes:
+            break
+    data = bytes(buf[:max_bytes])
+
+    charset_match = CHARSET_PATTERN.search(response.headers.get("Content-Type", ""))
+    encoding = charset_match.group(1) if charset_match else None
+    encoding = encoding or EncodingDetector.find_declared_encoding(data, is_html=True) or "utf-8"
+    try:
+        return data.decode(encoding, errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+
+PAGE_CHROME_TAGS = ['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe', 'noscript']
+
+
+def html_to_text(html_text: str) -> str:
+    """Strip scripts and page chrome from HTML and return its text, one block per line"""
+    if LexborHTMLParser:
+        # selectolax (lexbor, C) when installed: no Python object per node
+        tree = LexborHTMLParser(html_text)
+        tree.strip_tags(PAGE_CHROME_TAGS)
+        text = tree.text(separator='\n', strip=True)
+        # Whitespace-only nodes come back as empty lines; bs4 drops them
+        return '\n'.join(line for line in text.split('\n') if line)
+    soup = BeautifulSoup(html_text, HTML_PARSER)
+    for element in soup(PAGE_CHROME_TAGS):
+        element.decompose()
+    return soup.get_text(separator='\n', strip=True)
+
+
 def fetch_webpage_content(url: str) -> str:
-    """Fetch webpage content via Jina AI Reader (handles JS rendering, returns clean markdown)"""
+    """Fetch webpage content, reusing a recent successful fetch of the same URL"""
+    key = canonicalize_url(url)
+    content = _lru_cache_get(_webpage_cache, _webpage_cache_lock, key)
+    if content is not None:
+        print(f"[DEBUG] Webpage cache hit: {key}")
+        return content
+    content, ok = _fetch_webpage_content(url)
+    if ok:
+        _lru_cache_put(_webpage_cache, _webpage_cache_lock, key, content, WEBPAGE_CACHE_TTL, WEBPAGE_CACHE_MAXSIZE)
+    return content
+
+
+def _fetch_webpage_content(url: str) -> tuple[str, bool]:
+    """Fetch webpage content via Jina AI Reader (handles JS rendering, returns clean markdown)
+
+    Returns (content, ok); on failure content is an error message.
+    """
     try:
         jina_url = f"https://r.jina.ai/{url}"
         headers = {
             'Accept': 'text/plain',
             'X-Return-Format': 'markdown',
         }
-        response = requests.get(jina_url, headers=headers, timeout=15)
+        response = http_session.get(jina_url, headers=headers, timeout=15)
         response.raise_for_status()
         content = response.text
         if len(content) > 3000:
             content = content[:3000] + "..."
-        return content
+        return content, True
     except Exception as e:
         print(f"[DEBUG] Jina AI fetch failed: {str(e)}, falling back to direct fetch")
         try:
             headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe', 'noscript']):
-                element.decompose()
-            content = soup.get_text(separator='\n', strip=True)
-            lines = [line.strip() for line in content.split('\n') if len(line.strip()) > 20]
-            content = '\n'.join(lines)
+            response = http_session.get(url, headers=headers, timeout=5, stream=True)
+            try:
+                response.raise_for_status()
+                html_text = read_capped_html(response)
+            finally:
+                response.close()
+            content = html_to_text(html_text)
+            content = '\n'.join(WEBPAGE_LINE_PATTERN.findall(content))
             if len(content) > 2000:
                 content = content[:2000] + "..."
-            return content
+            return content, True
         except Exception as e2:
-            return f"無法抓取網頁內容：{str(e2)}"
+            return f"無法抓取網頁內容：{str(e2)}", False
 
     except Exception as e:
-        return f"無法抓取網頁內容：{str(e)}"
+        return f"無法抓取網頁內容：{str(e)}", False
 
 
 def extract_youtube_video_id(url: str) -> str:
@@ -1725,7 +2037,7 @@ def fetch_youtube_transcript(caption_url: str) -> str:
         if "fmt=" not in transcript_url:
             separator = "&" if "?" in transcript_url else "?"
             transcript_url = f"{transcript_url}{separator}fmt=json3"
-        response = requests.get(transcript_url, timeout=10)
+        response = http_session.get(transcript_url, timeout=10)
         response.raise_for_status()
         raw_text = response.text
         lines = []
@@ -1755,7 +2067,7 @@ def fetch_youtube_page_data(url: str) -> tuple[dict, str]:
     video_id = extract_youtube_video_id(url)
     watch_url = f"https://www.youtube.com/watch?v={video_id}" if video_id else url
     try:
-        response = requests.get(
+        response = http_session.get(
             watch_url,
             headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
             timeout=10,
@@ -1784,7 +2096,7 @@ def fetch_youtube_content(url: str) -> tuple[str, str]:
         "is_live": "",
     }
     try:
-        response = requests.get(
+        response = http_session.get(
             "https://www.youtube.com/oembed",
             params={"url": url, "format": "json"},
             timeout=10,
@@ -1987,7 +2299,7 @@ def fetch_ptt_content(url: str) -> tuple[str, str]:
     """Fetch PTT article content with over18 cookie."""
     try:
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        response = requests.get(url, headers=headers, cookies={"over18": "1"}, timeout=10)
+        response = http_session.get(url, headers=headers, cookies={"over18": "1"}, timeout=10)
         response.raise_for_status()
         article = parse_ptt_article_html(response.text, url)
         content = format_ptt_article(article)
@@ -2200,7 +2512,7 @@ def fetch_104_content(url: str) -> tuple[str, str]:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Referer': f'https://www.104.com.tw/job/{job_id}',
         }
-        response = requests.get(f"https://www.104.com.tw/job/ajax/content/{job_id}", headers=headers, timeout=10)
+        response = http_session.get(f"https://www.104.com.tw/job/ajax/content/{job_id}", headers=headers, timeout=10)
         response.raise_for_status()
         payload = response.json()
         job = normalize_104_job_payload(payload, url)
@@ -2224,11 +2536,26 @@ def fetch_content_by_source_type(url: str, source_type: str) -> tuple[str, str]:
     return fetch_webpage_content(url), "jina"
 
 
+# Upper bound on text sent to the summarizers. Long transcripts (voice notes,
+# YouTube captions) otherwise make completions slow and expensive without
+# improving a summary that is a handful of bullet points.
+SUMMARY_INPUT_MAX_CHARS = int(os.getenv("SUMMARY_INPUT_MAX_CHARS", 12000))
+
+
+def truncate_for_prompt(text: str, max_chars: int | None = None) -> str:
+    """Cut text to max_chars (default SUMMARY_INPUT_MAX_CHARS) for an LLM prompt, marking the cut"""
+    max_chars = max_chars or SUMMARY_INPUT_MAX_CHARS
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "\n\n...（內容過長，以下已截斷）"
+
+
 def summarize_webpage(content: str) -> str:
     """Use OpenAI to summarize webpage content"""
     if not openai_client:
         return "網頁摘要功能未設定，請設定 OPENAI_API_KEY"
 
+    content = truncate_for_prompt(content)
     try:
         prompt = f"""請分析以下網頁內容，用繁體中文提供完整摘要：
 
@@ -2314,8 +2641,8 @@ def summarize_google_maps(content: str, url: str) -> str:
         return f"地圖分析失敗：{str(e)}"
 
 
-# Known Whisper hallucination patterns
-HALLUCINATION_PATTERNS = [
+# Known Whisper hallucination patterns (a tuple: read-only, fixed regex order)
+HALLUCINATION_PATTERNS = (
     "请不吝点赞",
     "點贊訂閱",
     "订阅转发",
@@ -2336,33 +2663,109 @@ HALLUCINATION_PATTERNS = [
     "字幕提供",
     "subtitles by",
     "amara.org",
-]
+)
+
+# All patterns folded into one alternation so a transcript is scanned once
+HALLUCINATION_RE = re.compile("|".join(re.escape(p) for p in HALLUCINATION_PATTERNS), re.IGNORECASE)
 
 
 def is_hallucination(text: str) -> bool:
     """Check if the transcription is likely a hallucination"""
-    if not text or len(text.strip()) == 0:
-        return True
+    text = (text or "").strip()
 
-    text_lower = text.lower().strip()
-
-    # Check against known hallucination patterns
-    for pattern in HALLUCINATION_PATTERNS:
-        if pattern.lower() in text_lower:
-            return True
+    # Check if text is empty or too short
+    if len(text) < 5:
+        return True
 
-    # Check if text is too short and repetitive
-    if len(text_lower) < 5:
+    # Check against known hallucination patterns (case-insensitive regex)
+    if HALLUCINATION_RE.search(text):
         return True
 
     # Check if text is just repeated characters/words
-    words = text_lower.split()
+    words = text.lower().split()
     if len(words) > 2 and len(set(words)) == 1:
         return True
 
     return False
 
 
+# Transcripts with fewer meaningful characters than this are replied to but
+# not summarized or saved (e.g. "嗯，。。。" that slips past is_hallucination)
+AUDIO_MIN_USEFUL_CHARS = int(os.getenv("AUDIO_MIN_USEFUL_CHARS", 4))
+WORD_CHAR_PATTERN = re.compile(r'\w')
+
+
+def is_trivial_transcript(text: str) -> bool:
+    """Check if a transcript has too little content to be worth saving"""
+    # Stop counting once the threshold is reached; transcripts can be long
+    matches = islice(WORD_CHAR_PATTERN.finditer(text or ""), AUDIO_MIN_USEFUL_CHARS)
+    return sum(1 for _ in matches) < AUDIO_MIN_USEFUL_CHARS
+
+
+# Whisper rejects uploads over 25 MB; keep a margin for multipart overhead.
+WHISPER_MAX_AUDIO_BYTES = 24 * 1024 * 1024
+AUDIO_TOO_LARGE_MESSAGE = "⚠️ 語音過長，請分段錄製後再傳送（單則上限約 24MB）"
+# Read size for streamed LINE content; a few large reads instead of
+# hundreds of small ones per voice message
+LINE_CONTENT_CHUNK_SIZE = 256 * 1024
+
+
+def is_audio_too_large(content_length) -> bool:
+    """Check a Content-Length header value against the Whisper upload limit."""
+    try:
+        return int(content_length) >= WHISPER_MAX_AUDIO_BYTES
+    except (TypeError, ValueError):
+        return False
+
+
+# Concurrent Whisper uploads across the background pool; more than this and
+# bursts of voice messages start drawing 429s from OpenAI
+WHISPER_MAX_CONCURRENCY = int(os.getenv("WHISPER_MAX_CONCURRENCY", 8))
+whisper_semaphore = threading.BoundedSemaphore(WHISPER_MAX_CONCURRENCY)
+
+# Voice notes are re-encoded to 16 kHz mono Opus before upload when ffmpeg is
+# on PATH; tiny clips are sent as-is since the saving is not worth a process
+AUDIO_TRANSCODE_MIN_BYTES = 50_000
+FFMPEG_PATH = shutil.which("ffmpeg") if os.getenv("AUDIO_TRANSCODE", "true").lower() not in ("0", "false", "no") else None
+
+
+def transcode_for_whisper(audio_file: io.BytesIO) -> io.BytesIO:
+    """Shrink a voice message for upload; returns the original on any failure."""
+    audio_bytes = audio_file.getvalue()
+    if not FFMPEG_PATH or len(audio_bytes) < AUDIO_TRANSCODE_MIN_BYTES:
+        return audio_file
+    try:
+        result = subprocess.run(
+            [FFMPEG_PATH, "-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", "16000",
+             "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"],
+            input=audio_bytes,
+            capture_output=True,
+            timeout=60,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"[DEBUG] Audio transcode skipped: {str(e)}")
+        return audio_file
+    if not result.stdout or len(result.stdout) >= len(audio_bytes):
+        return audio_file
+    print(f"[DEBUG] Audio transcoded: {len(audio_bytes)} -> {len(result.stdout)} bytes")
+    transcoded = io.BytesIO(result.stdout)
+    transcoded.name = "audio.ogg"
+    return transcoded
+
+
+def open_line_message_content(message_id: str) -> HTTPResponse:
+    """Open a streaming download of LINE message content.
+
+    The body is not read yet, so callers can inspect headers such as
+    Content-Length before paying for the download.
+    """
+    response = line_blob_api.get_message_content_with_http_info(
+        message_id, _preload_content=False, _request_timeout=30
+    )
+    return response.raw_data
+
+
 def parse_summary_response(response: str) -> dict:
     """Parse category and keywords from AI summary response"""
     result = {
@@ -2738,14 +3141,33 @@ def save_contact_to_wiki(contact: dict) -> str | None:
     return save_wiki_page(name, full_content, subfolder="People")
 
 
+# Folder IDs by (parent_id, name). Vault folders are long-lived, so each save
+# skips the files.list round trips; cleared when a save fails in case a
+# cached folder was moved or deleted.
+gdrive_folder_cache: dict[tuple[str, str], str] = {}
+gdrive_folder_cache_lock = threading.Lock()
+
+
 def get_or_create_folder(service, folder_name: str, parent_id: str) -> str:
     """Get existing folder or create it if not found"""
+    key = (parent_id, folder_name)
+    with gdrive_folder_cache_lock:
+        folder_id = gdrive_folder_cache.get(key)
+    if folder_id:
+        return folder_id
+    folder_id = _find_or_create_folder(service, folder_name, parent_id)
+    with gdrive_folder_cache_lock:
+        gdrive_folder_cache[key] = folder_id
+    return folder_id
+
+
+def _find_or_create_folder(service, folder_name: str, parent_id: str) -> str:
     safe_name = folder_name.replace("'", "\\'")
     query = (
         f"name='{safe_name}' and '{parent_id}' in parents "
         f"and mimeType='application/vnd.google-apps.folder' and trashed=false"
     )
-    results = service.files().list(q=query, fields='files(id)').execute()
+    results = service.files().list(q=query, fields='files(id)').execute(num_retries=GDRIVE_NUM_RETRIES)
     files = results.get('files', [])
     if files:
         return files[0]['id']
@@ -2754,7 +3176,7 @@ def get_or_create_folder(service, folder_name: str, parent_id: str) -> str:
         'mimeType': 'application/vnd.google-apps.folder',
         'parents': [parent_id]
     }
-    folder = service.files().create(body=metadata, fields='id').execute()
+    folder = service.files().create(body=metadata, fields='id').execute(num_retries=GDRIVE_NUM_RETRIES)
     return folder['id']
 
 
@@ -2774,13 +3196,14 @@ def save_to_gdrive(
     needs_review: bool = False,
     raw_input: str = None,
     normalized_input: str = None,
+    service=None,
 ) -> bool:
     """Save content as .md file to ObsidianVault in Google Drive"""
     if not GDRIVE_VAULT_FOLDER_ID:
         print("[DEBUG] GDRIVE_VAULT_FOLDER_ID not set, skipping save")
         return False
     try:
-        service = get_gdrive_service()
+        service = service or get_gdrive_service()
         now = datetime.now()
         date_str = now.strftime("%Y-%m-%d")
         time_str = now.strftime("%H%M%S")
@@ -2826,15 +3249,145 @@ def save_to_gdrive(
 
         media = MediaInMemoryUpload(full_content.encode('utf-8'), mimetype='text/plain')
         file_metadata = {'name': filename, 'parents': [month_id]}
-        result = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        result = service.files().create(body=file_metadata, media_body=media, fields='id').execute(
+            num_retries=GDRIVE_NUM_RETRIES
+        )
 
         print(f"[DEBUG] Saved to Google Drive: {filename}")
         return result.get('id')
     except Exception as e:
         print(f"[DEBUG] Google Drive save error: {str(e)}")
+        with gdrive_folder_cache_lock:
+            gdrive_folder_cache.clear()
         return None
 
 
+# Notes saved after a reply are queued and written by a single worker, which
+# drains whatever arrives within a short window and shares one Drive service
+# (credentials + connection) across the batch. Notes that 「補充想法」 may target
+# are saved right away on the background pool instead.
+GDRIVE_SAVE_BATCH_SIZE = 10
+GDRIVE_SAVE_BATCH_WINDOW = 1.0  # seconds
+GDRIVE_PENDING_SAVE_TIMEOUT = 15  # seconds
+# How long process exit waits for the worker to flush notes still queued;
+# below gunicorn's default 30 s graceful timeout
+GDRIVE_SAVE_SHUTDOWN_TIMEOUT = 20  # seconds
+gdrive_save_queue: queue.Queue = queue.Queue()
+# Queued after the last note on shutdown; the worker exits once it gets here
+GDRIVE_SAVE_STOP = object()
+
+
+def queue_gdrive_save(remember_last_file: bool = False, **fields) -> None:
+    """Save a note to Google Drive in the background.
+
+    Takes the same keyword arguments as save_to_gdrive. With remember_last_file,
+    the saved file becomes the user's target for 「補充想法」; those saves skip the
+    batch window so the file id is known as soon as possible.
+    """
+    user_id = fields.get("user_id")
+    if remember_last_file and user_id:
+        submit_last_file_task(user_id, _save_and_remember_last_file, fields)
+        return
+    gdrive_save_queue.put(fields)
+
+
+def submit_last_file_task(user_id: str, fn, *args) -> Future:
+    """Run a task that sets user_last_file on the background pool.
+
+    「補充想法」 waits for the user's in-flight task before picking its target.
+    """
+    future = background_executor.submit(fn, *args)
+    with user_pending_last_file_lock:
+        user_pending_last_file[user_id] = future
+    future.add_done_callback(lambda done: _forget_pending_last_file(user_id, done))
+    return future
+
+
+def _forget_pending_last_file(user_id: str, future: Future) -> None:
+    """Drop a finished task unless a newer one has replaced it"""
+    with user_pending_last_file_lock:
+        if user_pending_last_file.get(user_id) is future:
+            del user_pending_last_file[user_id]
+
+
+def _save_and_remember_last_file(fields: dict) -> str | None:
+    """Save a note and record it as the user's last file"""
+    file_id = save_to_gdrive(**fields)
+    if file_id:
+        user_last_file[fields["user_id"]] = {"file_id": file_id, "title": fields["title"], "saved_at": time.time()}
+    return file_id
+
+
+def wait_for_pending_last_file(user_id: str) -> None:
+    """Wait for an in-flight task that will set the user's last file"""
+    pending = user_pending_last_file.get(user_id)
+    if pending is None:
+        return
+    try:
+        pending.result(timeout=GDRIVE_PENDING_SAVE_TIMEOUT)
+    except Exception as e:
+        print(f"[DEBUG] Pending Google Drive save not ready: {str(e)}")
+
+
+def _drain_gdrive_save_batch() -> list:
+    """Block for one queued save, then collect any others within the batch window"""
+    batch = [gdrive_save_queue.get()]
+    deadline = time.monotonic() + GDRIVE_SAVE_BATCH_WINDOW
+    while len(batch) < GDRIVE_SAVE_BATCH_SIZE and batch[-1] is not GDRIVE_SAVE_STOP:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(gdrive_save_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def gdrive_save_worker():
+    """Background thread that writes queued notes to Google Drive"""
+    while True:
+        batch = _drain_gdrive_save_batch()
+        stop = batch[-1] is GDRIVE_SAVE_STOP
+        if stop:
+            batch.pop()
+        if batch:
+            _flush_gdrive_save_batch(batch)
+        if stop:
+            return
+
+
+def _flush_gdrive_save_batch(batch: list) -> None:
+    """Write one batch of queued notes with a shared Drive service"""
+    try:
+        service = get_gdrive_service() if GDRIVE_VAULT_FOLDER_ID else None
+    except Exception as e:
+        print(f"[DEBUG] Google Drive service error: {str(e)}")
+        service = None
+    for fields in batch:
+        try:
+            if not save_to_gdrive(service=service, **fields):
+                print(f"[DEBUG] Queued Google Drive save failed: {fields.get('title')}")
+        except Exception as e:
+            print(f"[DEBUG] Queued Google Drive save error: {str(e)}")
+    print(f"[DEBUG] Flushed {len(batch)} queued Google Drive save(s)")
+
+
+def flush_gdrive_saves_on_exit() -> None:
+    """Let the worker write notes still queued when the process shuts down.
+
+    The worker is a daemon thread, so without this a worker restart or deploy
+    would silently drop notes the user was already told were saved.
+    """
+    gdrive_save_queue.put(GDRIVE_SAVE_STOP)
+    gdrive_save_thread.join(timeout=GDRIVE_SAVE_SHUTDOWN_TIMEOUT)
+
+
+gdrive_save_thread = threading.Thread(target=gdrive_save_worker, daemon=True)
+gdrive_save_thread.start()
+atexit.register(flush_gdrive_saves_on_exit)
+
+
 def append_to_gdrive_file(file_id: str, extra_content: str) -> bool:
     """Append additional thoughts to an existing Google Drive file"""
     try:
@@ -3504,6 +4057,51 @@ def save_normalized_social_post(
     }
 
 
+def save_social_posts(posts: list[dict], platform: str, fallback_url: str, raw_input: str, user_id: str) -> int:
+    """Summarize and save scraped posts concurrently; returns how many were saved."""
+    def _save_one(index: int, post_data: dict) -> bool:
+        try:
+            normalized_data = normalize_social_post_data(post_data, platform)
+            post_url = post_data.get("url") or post_data.get("postUrl") or fallback_url
+            fid, _capture = save_normalized_social_post(
+                platform=platform,
+                normalized_data=normalized_data,
+                source_url=post_url,
+                raw_input=raw_input,
+                user_id=user_id,
+            )
+            if fid:
+                print(f"[DEBUG] Saved post {index + 1}/{len(posts)}")
+            return bool(fid)
+        except Exception as e:
+            print(f"[DEBUG] Error processing post {index + 1}: {str(e)}")
+            return False
+
+    if not posts:
+        return 0
+    # Each post is an independent LLM call + Drive upload, so run them side by side
+    with ThreadPoolExecutor(max_workers=min(SCRAPE_SAVE_CONCURRENCY, len(posts))) as pool:
+        return sum(pool.map(_save_one, range(len(posts)), posts))
+
+
+def scrape_social_posts_async(user_id: str, url: str, platform: str, max_posts: int, raw_input: str) -> None:
+    """Scrape and save several social posts, then push the result (runs on background_executor)"""
+    try:
+        posts = scrape_facebook_post(url, max_posts) if platform == "facebook" else scrape_threads_post(url, max_posts)
+        if not posts:
+            result_text = "❌ 無法爬取貼文，可能是私人帳號或網址無效"
+        else:
+            saved_count = save_social_posts(posts, platform, url, raw_input=raw_input, user_id=user_id)
+            result_text = f"✅ 完成！已爬取 {len(posts)} 篇貼文，成功存入 Obsidian {saved_count} 篇"
+    except Exception as e:
+        print(f"[DEBUG] Multi-post scraping error: {str(e)}")
+        result_text = "❌ 爬取貼文失敗，請稍後再試"
+    try:
+        line_messaging_api.push_message(PushMessageRequest(to=user_id, messages=[TextMessage(text=result_text)]))
+    except Exception as e:
+        print(f"[DEBUG] Multi-post scraping push error: {str(e)}")
+
+
 @app.route("/callback", methods=["POST"])
 def callback():
     signature = request.headers.get("X-Line-Signature", "")
@@ -3596,7 +4194,10 @@ def translate_text(text: str, target_language: str) -> str:
 
 def parse_translation_request(text: str) -> tuple[str, str] | None:
     """Parse translation request and return (target_language, text_to_translate)"""
-    match = TRANSLATE_PATTERN.match(text.strip())
+    text = text.strip()
+    if not text.startswith(TRANSLATE_PREFIXES):
+        return None
+    match = TRANSLATE_PATTERN.match(text)
     if not match:
         return None
 
@@ -3618,6 +4219,7 @@ def summarize_text(text: str) -> str:
     if not openai_client:
         return "文字摘要功能未設定，請設定 OPENAI_API_KEY"
 
+    text = truncate_for_prompt(text)
     try:
         prompt = f"""請分析以下文字內容，用繁體中文提供完整摘要：
 
@@ -3655,276 +4257,323 @@ def summarize_text(text: str) -> str:
         return f"摘要生成失敗：{str(e)}"
 
 
-@handler.add(MessageEvent, message=TextMessageContent)
-def handle_text_message(event):
-    """Handle text messages - translation, URL summary, or text summary"""
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
+def show_loading_animation(event, seconds: int = 20) -> None:
+    """Show LINE's loading indicator while a slow reply is being generated.
 
-        text = event.message.text.strip()
-        user_id = event.source.user_id
-        print(f"[DEBUG] Received text: {text}, user_id: {user_id}")
-
-        if is_linebot_usage_help_request(text):
-            usage_intro = (
-                "LINE Bot 功能說明\n\n"
-                "平常直接傳文字、網址、圖片或語音即可保存。"
-                "需要查詢或整理時，再輸入圖卡中的指令。"
-                "\n\n輸入「工作流」可以查看每天捕捉與定期整理節奏。"
-            )
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=usage_intro), *build_linebot_usage_image_messages()],
-                )
-            )
-            return
+    Only supported in one-on-one chats; it disappears when the reply arrives.
+    """
+    if getattr(event.source, "type", None) != "user":
+        return
+    try:
+        line_messaging_api.show_loading_animation(
+            ShowLoadingAnimationRequest(chat_id=event.source.user_id, loading_seconds=seconds)
+        )
+    except Exception as e:
+        print(f"[DEBUG] Loading animation error: {str(e)}")
 
-        if is_linebot_workflow_help_request(text):
-            workflow_intro = (
-                "LINE Bot 工作流\n\n"
-                "每天先把素材丟進來，定期再請 AI Agent 整理成 Wiki、週報或行動清單。"
-            )
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=workflow_intro), *build_linebot_workflow_image_messages()],
-                )
-            )
-            return
 
-        if is_linebot_drive_diagnostic_request(text):
-            diagnostic = run_gdrive_diagnostic(user_id=user_id)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=build_gdrive_diagnostic_message(diagnostic))],
-                )
-            )
-            return
+def reply_text(event, text: str) -> None:
+    """Reply to an event with a single text message.
 
-        # 今日回顧指令
-        if text in ["今日回顧", "今天存了什麼", "回顧"]:
-            files = get_today_files()
-            if not files:
-                reply_text = "今天還沒有任何記錄，快去捕捉些什麼吧！"
-            else:
-                names = "\n".join(f"• {f['name'].replace('.md','')}" for f in files[:10])
-                reply_text = f"📚 今日記錄（共 {len(files)} 筆）\n\n{names}"
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(
-                    text=reply_text,
-                )])
-            )
-            return
+    The request shape is fixed, so the models are built with construct() and
+    skip pydantic validation; the serialized payload is the same.
+    """
+    line_messaging_api.reply_message_with_http_info(
+        ReplyMessageRequest.construct(reply_token=event.reply_token, messages=[TextMessage.construct(text=text)])
+    )
 
-        # 本週回顧 / 消化狀態指令
-        if text in ["本週回顧", "這週回顧", "消化狀態"]:
-            notes = list_recent_source_notes(days=7)
-            title = "消化狀態" if text == "消化狀態" else "本週回顧"
-            reply_text = format_weekly_review(notes, title=title)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(
-                    text=reply_text,
-                )])
-            )
-            return
 
-        # 整理本週：產生 weekly digest，不直接改 Wiki
-        if text in ["整理本週", "週整理", "本週整理"]:
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="開始整理近 7 天捕捉內容，完成後會推送週報摘要。")]
-                )
-            )
+def push_target_id(event) -> str:
+    """Return the chat a push should go to: the group or room the event came from, else the user."""
+    source = event.source
+    source_type = getattr(source, "type", None)
+    if source_type == "group":
+        return source.group_id
+    if source_type == "room":
+        return source.room_id
+    return source.user_id
 
-            def _weekly_digest_async(uid):
-                try:
-                    notes = list_recent_source_notes(days=7)
-                    digest_id = save_weekly_digest(notes)
-                    result_text = format_weekly_review(notes, title="本週知識消化")
-                    if digest_id:
-                        result_text += "\n\n已寫入 Obsidian weekly-digests。"
-                    else:
-                        result_text += "\n\n週報寫入失敗，請稍後再試。"
-                    with ApiClient(configuration) as push_client:
-                        MessagingApi(push_client).push_message(PushMessageRequest(
-                            to=uid,
-                            messages=[TextMessage(text=result_text)]
-                        ))
-                except Exception as ex:
-                    print(f"[DEBUG] Weekly digest async error: {str(ex)}")
-                    try:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text="整理本週失敗，請稍後再試。")]
-                            ))
-                    except Exception:
-                        pass
 
-            threading.Thread(target=_weekly_digest_async, args=(user_id,), daemon=True).start()
-            return
+def reply_or_push(event, messages: list) -> None:
+    """Reply to an event, falling back to a push if the reply token has expired.
 
-        # 補充想法指令
-        if text.startswith("補充想法：") or text.startswith("補充想法:"):
-            extra = text.split("：", 1)[-1].split(":", 1)[-1].strip()
-            last = user_last_file.get(user_id)
-            if not last:
-                latest = get_latest_today_file()
-                if latest:
-                    last = {"file_id": latest["id"], "title": latest["name"].replace(".md", ""), "saved_at": time.time()}
-                    user_last_file[user_id] = last
-            if last and extra:
-                success = append_to_gdrive_file(last["file_id"], extra)
-                if success:
-                    reply_msg = TextMessage(text=f"✅ 已補充到「{last['title']}」\n\n💭 {extra}")
-                else:
-                    reply_msg = TextMessage(text="❌ 補充失敗，請稍後再試")
-            else:
-                reply_msg = TextMessage(text="找不到最近的筆記，請重新傳送一則訊息後再補充。")
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[reply_msg])
+    For results produced in the background, which may outlive the token.
+    """
+    try:
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+        )
+    except ApiException as e:
+        if e.status != 400:
+            raise
+        print(f"[DEBUG] Reply token rejected, pushing instead: {str(e)}")
+        line_messaging_api.push_message(PushMessageRequest(to=push_target_id(event), messages=messages))
+
+
+@handler.add(MessageEvent, message=TextMessageContent)
+def handle_text_message(event):
+    """Handle text messages - translation, URL summary, or text summary"""
+    text = event.message.text.strip()
+    user_id = event.source.user_id
+    print(f"[DEBUG] Received text: {text}, user_id: {user_id}")
+
+    if is_linebot_usage_help_request(text):
+        usage_intro = (
+            "LINE Bot 功能說明\n\n"
+            "平常直接傳文字、網址、圖片或語音即可保存。"
+            "需要查詢或整理時，再輸入圖卡中的指令。"
+            "\n\n輸入「工作流」可以查看每天捕捉與定期整理節奏。"
+        )
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[TextMessage(text=usage_intro), *build_linebot_usage_image_messages()],
             )
-            return
+        )
+        return
 
-        # 查詢指令：查 投資 / 搜尋 AI / 找 日本
-        query_match = re.match(r'^(?:查|搜尋|找)\s+(.+)$', text.strip())
-        if query_match:
-            keyword = query_match.group(1).strip()
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"🔍 正在搜尋「{keyword}」的相關筆記...")]
-                )
+    if is_linebot_workflow_help_request(text):
+        workflow_intro = (
+            "LINE Bot 工作流\n\n"
+            "每天先把素材丟進來，定期再請 AI Agent 整理成 Wiki、週報或行動清單。"
+        )
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[TextMessage(text=workflow_intro), *build_linebot_workflow_image_messages()],
             )
+        )
+        return
 
-            def _search_async(uid, kw):
-                try:
-                    matched_files = search_sources(kw, limit=8)
-                    if not matched_files:
-                        result_text = f"找不到關於「{kw}」的筆記\n\n💡 試試其他關鍵字，或先存一些相關內容"
-                    else:
-                        files_content = []
-                        for f in matched_files[:5]:
-                            content = read_gdrive_file(f['id'])
-                            if content:
-                                files_content.append((f['name'], content))
-                        if files_content:
-                            result_text = summarize_search_results(kw, files_content)
-                        else:
-                            names = "\n".join(f"• {f['name'].replace('.md','')}" for f in matched_files[:8])
-                            result_text = f"🔍 找到 {len(matched_files)} 筆關於「{kw}」的記錄：\n\n{names}"
+    if is_linebot_drive_diagnostic_request(text):
+        def _drive_diagnostic_async(evt, uid):
+            try:
+                diagnostic = run_gdrive_diagnostic(user_id=uid)
+                reply_or_push(evt, [TextMessage(text=build_gdrive_diagnostic_message(diagnostic))])
+            except Exception as ex:
+                print(f"[DEBUG] Drive diagnostic async error: {str(ex)}")
 
-                    with ApiClient(configuration) as push_client:
-                        MessagingApi(push_client).push_message(PushMessageRequest(
-                            to=uid,
-                            messages=[TextMessage(text=result_text)]
-                        ))
-                except Exception as ex:
-                    print(f"[DEBUG] Search async error: {str(ex)}")
-                    try:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text="❌ 搜尋失敗，請稍後再試")]
-                            ))
-                    except Exception:
-                        pass
+        background_executor.submit(_drive_diagnostic_async, event, user_id)
+        return
 
-            threading.Thread(target=_search_async, args=(user_id, keyword), daemon=True).start()
-            return
+    # 今日回顧指令
+    if text in ["今日回顧", "今天存了什麼", "回顧"]:
+        def _today_review_async(evt):
+            try:
+                files = get_today_files()
+                if not files:
+                    today_text = "今天還沒有任何記錄，快去捕捉些什麼吧！"
+                else:
+                    names = "\n".join(f"• {f['name'].replace('.md','')}" for f in files[:10])
+                    today_text = f"📚 今日記錄（共 {len(files)} 筆）\n\n{names}"
+                reply_or_push(evt, [TextMessage(text=today_text)])
+            except Exception as ex:
+                print(f"[DEBUG] Today review async error: {str(ex)}")
+
+        background_executor.submit(_today_review_async, event)
+        return
+
+    # 本週回顧 / 消化狀態指令
+    if text in ["本週回顧", "這週回顧", "消化狀態"]:
+        def _weekly_review_async(evt, title):
+            try:
+                notes = list_recent_source_notes(days=7)
+                reply_or_push(evt, [TextMessage(text=format_weekly_review(notes, title=title))])
+            except Exception as ex:
+                print(f"[DEBUG] Weekly review async error: {str(ex)}")
 
-        # 整理筆記指令：讀取 Sources，整合成 Wiki 頁面
-        if text in ["整理筆記", "整理", "wiki整理", "Wiki整理"]:
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="📚 開始整理本月筆記...\n\n找出主題超過 3 篇的筆記，自動生成 Wiki 頁面。\n（通常需要 1-3 分鐘）")]
-                )
-            )
+        background_executor.submit(_weekly_review_async, event, "消化狀態" if text == "消化狀態" else "本週回顧")
+        return
 
-            def _consolidate_async(uid):
+    # 整理本週：產生 weekly digest，不直接改 Wiki
+    if text in ["整理本週", "週整理", "本週整理"]:
+        reply_text(event, "開始整理近 7 天捕捉內容，完成後會推送週報摘要。")
+
+        def _weekly_digest_async(uid):
+            try:
+                notes = list_recent_source_notes(days=7)
+                digest_id = save_weekly_digest(notes)
+                result_text = format_weekly_review(notes, title="本週知識消化")
+                if digest_id:
+                    result_text += "\n\n已寫入 Obsidian weekly-digests。"
+                else:
+                    result_text += "\n\n週報寫入失敗，請稍後再試。"
+                line_messaging_api.push_message(PushMessageRequest(
+                    to=uid,
+                    messages=[TextMessage(text=result_text)]
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Weekly digest async error: {str(ex)}")
                 try:
-                    result = run_consolidate_sources()
-                    month_str = result["month"]
-                    if result["total"] == 0:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text=f"本月（{month_str}）還沒有任何筆記")]
-                            ))
-                        return
-
-                    summary_lines = [f"📚 整理完成（{month_str}）\n"]
-                    summary_lines.append(f"共 {result['total']} 篇筆記 → {len(result['consolidated'])} 個 Wiki 頁面\n")
-                    if result["consolidated"]:
-                        summary_lines.append("已生成 Wiki：")
-                        summary_lines.extend(f"✅ {line}" for line in result["consolidated"])
-                    if result["skipped"]:
-                        summary_lines.append("\n待累積（未達 3 篇）：")
-                        summary_lines.extend(f"⏳ {line}" for line in result["skipped"])
-                    result_text = "\n".join(summary_lines)
-
-                    with ApiClient(configuration) as push_client:
-                        MessagingApi(push_client).push_message(PushMessageRequest(
-                            to=uid,
-                            messages=[TextMessage(text=result_text)]
-                        ))
-                except Exception as ex:
-                    print(f"[DEBUG] Consolidate async error: {str(ex)}")
-                    try:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text="❌ 整理失敗，請稍後再試")]
-                            ))
-                    except Exception:
-                        pass
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text="整理本週失敗，請稍後再試。")]
+                    ))
+                except Exception:
+                    pass
 
-            threading.Thread(target=_consolidate_async, args=(user_id,), daemon=True).start()
-            return
+        background_executor.submit(_weekly_digest_async, user_id)
+        return
 
-        # 查行程指令
-        schedule_query = re.match(r'^(?:查行程|行程|今天行程|明天行程|這週行程|下週行程|本週行程)$', text.strip())
-        if schedule_query:
-            keyword = text.strip()
-            if "今天" in keyword:
-                events = get_today_events()
-                reply = format_event_list(events, "今天的")
-            elif "明天" in keyword:
+    # 補充想法指令
+    if text.startswith("補充想法：") or text.startswith("補充想法:"):
+        extra = text.split("：", 1)[-1].split(":", 1)[-1].strip()
+
+        def _append_supplement_async(evt, uid, ext):
+            try:
+                wait_for_pending_last_file(uid)
+                last = user_last_file.get(uid)
+                if not last:
+                    latest = get_latest_today_file()
+                    if latest:
+                        last = {"file_id": latest["id"], "title": latest["name"].replace(".md", ""), "saved_at": time.time()}
+                        user_last_file[uid] = last
+                if last and ext:
+                    success = append_to_gdrive_file(last["file_id"], ext)
+                    if success:
+                        reply_msg = TextMessage(text=f"✅ 已補充到「{last['title']}」\n\n💭 {ext}")
+                    else:
+                        reply_msg = TextMessage(text="❌ 補充失敗，請稍後再試")
+                else:
+                    reply_msg = TextMessage(text="找不到最近的筆記，請重新傳送一則訊息後再補充。")
+                reply_or_push(evt, [reply_msg])
+            except Exception as ex:
+                print(f"[DEBUG] Supplement async error: {str(ex)}")
                 try:
-                    service = get_calendar_service()
-                    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-                    start = f"{tomorrow}T00:00:00+08:00"
-                    end = f"{tomorrow}T23:59:59+08:00"
-                    events = []
-                    seen_keys = set()
-                    for cal_id in GOOGLE_CALENDAR_IDS:
-                        try:
-                            result = service.events().list(
-                                calendarId=cal_id, timeMin=start, timeMax=end,
-                                maxResults=10, singleEvents=True, orderBy='startTime'
-                            ).execute()
-                            for evt in result.get('items', []):
-                                key = (evt.get('summary', ''), evt.get('start', {}).get('dateTime', evt.get('start', {}).get('date', '')))
-                                if key not in seen_keys:
-                                    seen_keys.add(key)
-                                    events.append(evt)
-                        except Exception as ce:
-                            print(f"[DEBUG] List tomorrow events error in {cal_id}: {str(ce)}")
-                    events.sort(key=lambda e: e['start'].get('dateTime', e['start'].get('date', '')))
-                    reply = format_event_list(events, "明天的")
+                    reply_or_push(evt, [TextMessage(text="❌ 補充失敗，請稍後再試")])
+                except Exception:
+                    pass
+
+        show_loading_animation(event)
+        background_executor.submit(_append_supplement_async, event, user_id, extra)
+        return
+
+    # 查詢指令：查 投資 / 搜尋 AI / 找 日本
+    command = COMMAND_PATTERN.match(text)
+    command_type = command.lastgroup if command else None
+
+    if command_type == "query":
+        keyword = command.group("keyword").strip()
+        reply_text(event, f"🔍 正在搜尋「{keyword}」的相關筆記...")
+
+        def _search_async(uid, kw):
+            try:
+                matched_files = search_sources(kw, limit=8)
+                if not matched_files:
+                    result_text = f"找不到關於「{kw}」的筆記\n\n💡 試試其他關鍵字，或先存一些相關內容"
+                else:
+                    files_content = []
+                    for f in matched_files[:5]:
+                        content = read_gdrive_file(f['id'])
+                        if content:
+                            files_content.append((f['name'], content))
+                    if files_content:
+                        result_text = summarize_search_results(kw, files_content)
+                    else:
+                        names = "\n".join(f"• {f['name'].replace('.md','')}" for f in matched_files[:8])
+                        result_text = f"🔍 找到 {len(matched_files)} 筆關於「{kw}」的記錄：\n\n{names}"
+
+                line_messaging_api.push_message(PushMessageRequest(
+                    to=uid,
+                    messages=[TextMessage(text=result_text)]
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Search async error: {str(ex)}")
+                try:
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text="❌ 搜尋失敗，請稍後再試")]
+                    ))
                 except Exception:
-                    reply = "❌ 無法取得行程，請確認行事曆已設定"
-            else:
-                days = 14 if "下週" in keyword else 7
-                events = list_upcoming_events(days=days)
-                label = "這週" if days == 7 else "近兩週"
-                reply = format_event_list(events, label)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(
+                    pass
+
+        background_executor.submit(_search_async, user_id, keyword)
+        return
+
+    # 整理筆記指令：讀取 Sources，整合成 Wiki 頁面
+    if text in ["整理筆記", "整理", "wiki整理", "Wiki整理"]:
+        reply_text(event, "📚 開始整理本月筆記...\n\n找出主題超過 3 篇的筆記，自動生成 Wiki 頁面。\n（通常需要 1-3 分鐘）")
+
+        def _consolidate_async(uid):
+            try:
+                result = run_consolidate_sources()
+                month_str = result["month"]
+                if result["total"] == 0:
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text=f"本月（{month_str}）還沒有任何筆記")]
+                    ))
+                    return
+
+                summary_lines = [f"📚 整理完成（{month_str}）\n"]
+                summary_lines.append(f"共 {result['total']} 篇筆記 → {len(result['consolidated'])} 個 Wiki 頁面\n")
+                if result["consolidated"]:
+                    summary_lines.append("已生成 Wiki：")
+                    summary_lines.extend(f"✅ {line}" for line in result["consolidated"])
+                if result["skipped"]:
+                    summary_lines.append("\n待累積（未達 3 篇）：")
+                    summary_lines.extend(f"⏳ {line}" for line in result["skipped"])
+                result_text = "\n".join(summary_lines)
+
+                line_messaging_api.push_message(PushMessageRequest(
+                    to=uid,
+                    messages=[TextMessage(text=result_text)]
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Consolidate async error: {str(ex)}")
+                try:
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text="❌ 整理失敗，請稍後再試")]
+                    ))
+                except Exception:
+                    pass
+
+        background_executor.submit(_consolidate_async, user_id)
+        return
+
+    # 查行程指令
+    if command_type == "schedule":
+        def _schedule_async(evt, kw):
+            try:
+                if "今天" in kw:
+                    events = get_today_events()
+                    reply = format_event_list(events, "今天的")
+                elif "明天" in kw:
+                    try:
+                        service = get_calendar_service()
+                        tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+                        start = f"{tomorrow}T00:00:00+08:00"
+                        end = f"{tomorrow}T23:59:59+08:00"
+                        events = []
+                        seen_keys = set()
+                        for cal_id in GOOGLE_CALENDAR_IDS:
+                            try:
+                                result = service.events().list(
+                                    calendarId=cal_id, timeMin=start, timeMax=end,
+                                    maxResults=10, singleEvents=True, orderBy='startTime'
+                                ).execute()
+                                for cal_evt in result.get('items', []):
+                                    key = (cal_evt.get('summary', ''), cal_evt.get('start', {}).get('dateTime', cal_evt.get('start', {}).get('date', '')))
+                                    if key not in seen_keys:
+                                        seen_keys.add(key)
+                                        events.append(cal_evt)
+                            except Exception as ce:
+                                print(f"[DEBUG] List tomorrow events error in {cal_id}: {str(ce)}")
+                        events.sort(key=lambda e: e['start'].get('dateTime', e['start'].get('date', '')))
+                        reply = format_event_list(events, "明天的")
+                    except Exception:
+                        reply = "❌ 無法取得行程，請確認行事曆已設定"
+                else:
+                    days = 14 if "下週" in kw else 7
+                    events = list_upcoming_events(days=days)
+                    label = "這週" if days == 7 else "近兩週"
+                    reply = format_event_list(events, label)
+            except Exception as ex:
+                print(f"[DEBUG] Schedule async error: {str(ex)}")
+                reply = "❌ 無法取得行程，請確認行事曆已設定"
+            try:
+                reply_or_push(evt, [TextMessage(
                     text=reply,
                     quick_reply=QuickReply(items=[
                         QuickReplyItem(action=MessageAction(label="今天行程", text="今天行程")),
@@ -3932,885 +4581,658 @@ def handle_text_message(event):
                         QuickReplyItem(action=MessageAction(label="加行程", text="加行程：")),
                     ])
                 )])
-            )
-            return
-
-        # 加行程指令
-        add_event_match = re.match(r'^(?:加行程|新增行程|加入行程|記行程)[：:]\s*(.+)$', text.strip())
-        if add_event_match:
-            event_text = add_event_match.group(1).strip()
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"📅 正在新增行程...\n「{event_text}」")])
-            )
+            except Exception as ex:
+                print(f"[DEBUG] Schedule reply error: {str(ex)}")
+
+        background_executor.submit(_schedule_async, event, text.strip())
+        return
+
+    # 加行程指令
+    if command_type == "add_event":
+        event_text = command.group("event_text").strip()
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(reply_token=event.reply_token,
+                messages=[TextMessage(text=f"📅 正在新增行程...\n「{event_text}」")])
+        )
 
-            def _add_event_async(uid, evt_text):
-                try:
-                    parsed = parse_event_from_text(evt_text)
-                    if not parsed or not parsed.get('title') or not parsed.get('date'):
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text="❌ 無法解析行程內容\n\n試試這個格式：\n加行程：週五下午3點 跟 Jason 開會 地點：台北")]
-                            ))
-                        return
-                    result = create_calendar_event(
-                        title=parsed['title'],
-                        date=parsed['date'],
-                        start_time=parsed.get('start_time', '09:00'),
-                        end_time=parsed.get('end_time', '10:00'),
-                        location=parsed.get('location', ''),
-                        description=parsed.get('description', '')
+        def _add_event_async(uid, evt_text):
+            try:
+                parsed = parse_event_from_text(evt_text)
+                if not parsed or not parsed.get('title') or not parsed.get('date'):
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text="❌ 無法解析行程內容\n\n試試這個格式：\n加行程：週五下午3點 跟 Jason 開會 地點：台北")]
+                    ))
+                    return
+                result = create_calendar_event(
+                    title=parsed['title'],
+                    date=parsed['date'],
+                    start_time=parsed.get('start_time', '09:00'),
+                    end_time=parsed.get('end_time', '10:00'),
+                    location=parsed.get('location', ''),
+                    description=parsed.get('description', '')
+                )
+                if result > 0:
+                    time_display = "全天" if parsed.get('start_time') == "00:00" else f"{parsed.get('start_time')} - {parsed.get('end_time')}"
+                    loc_str = f"\n📍 {parsed['location']}" if parsed.get('location') else ""
+                    note_str = f"\n📝 {parsed['description']}" if parsed.get('description') else ""
+                    cal_str = f"\n🗂 已同步 {result} 個行事曆" if len(GOOGLE_CALENDAR_IDS) > 1 else ""
+                    calendar_reply = (
+                        f"✅ 已加入行事曆\n\n"
+                        f"📌 {parsed['title']}\n"
+                        f"📅 {parsed['date']} {time_display}"
+                        f"{loc_str}{note_str}{cal_str}"
                     )
-                    if result > 0:
-                        time_display = "全天" if parsed.get('start_time') == "00:00" else f"{parsed.get('start_time')} - {parsed.get('end_time')}"
-                        loc_str = f"\n📍 {parsed['location']}" if parsed.get('location') else ""
-                        note_str = f"\n📝 {parsed['description']}" if parsed.get('description') else ""
-                        cal_str = f"\n🗂 已同步 {result} 個行事曆" if len(GOOGLE_CALENDAR_IDS) > 1 else ""
-                        reply_text = (
-                            f"✅ 已加入行事曆\n\n"
-                            f"📌 {parsed['title']}\n"
-                            f"📅 {parsed['date']} {time_display}"
-                            f"{loc_str}{note_str}{cal_str}"
-                        )
-                    else:
-                        reply_text = "❌ 行程新增失敗，請確認 Calendar API 已啟用並把行事曆共用給 Service Account"
-                    with ApiClient(configuration) as push_client:
-                        MessagingApi(push_client).push_message(PushMessageRequest(
-                            to=uid,
-                            messages=[TextMessage(
-                                text=reply_text,
-                                quick_reply=QuickReply(items=[
-                                    QuickReplyItem(action=MessageAction(label="查行程", text="這週行程")),
-                                    QuickReplyItem(action=MessageAction(label="再加一個", text="加行程：")),
-                                ])
-                            )]
-                        ))
-                except Exception as ex:
-                    print(f"[DEBUG] Add event async error: {str(ex)}")
-                    try:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid, messages=[TextMessage(text="❌ 新增行程失敗，請稍後再試")]
-                            ))
-                    except Exception:
-                        pass
-
-            threading.Thread(target=_add_event_async, args=(user_id, event_text), daemon=True).start()
-            return
-
-        # 加聯絡人指令：解析自然語言 → 存到 Wiki/People/
-        add_contact_match = re.match(r'^(?:加聯絡人|新增聯絡人|記聯絡人|加人脈)[：:]\s*(.+)$', text.strip())
-        if add_contact_match:
-            contact_text = add_contact_match.group(1).strip()
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"👤 正在新增聯絡人...\n「{contact_text[:60]}」")])
-            )
-
-            def _add_contact_async(uid, ct_text):
+                else:
+                    calendar_reply = "❌ 行程新增失敗，請確認 Calendar API 已啟用並把行事曆共用給 Service Account"
+                line_messaging_api.push_message(PushMessageRequest(
+                    to=uid,
+                    messages=[TextMessage(
+                        text=calendar_reply,
+                        quick_reply=QuickReply(items=[
+                            QuickReplyItem(action=MessageAction(label="查行程", text="這週行程")),
+                            QuickReplyItem(action=MessageAction(label="再加一個", text="加行程：")),
+                        ])
+                    )]
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Add event async error: {str(ex)}")
                 try:
-                    parsed = parse_contact_from_text(ct_text)
-                    if not parsed:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text="❌ 無法解析聯絡人資訊\n\n試試這個格式：\n加聯絡人：Jason 同事 ABC 公司工程師 0912345678 在 AWS 大會認識")]
-                            ))
-                        return
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid, messages=[TextMessage(text="❌ 新增行程失敗，請稍後再試")]
+                    ))
+                except Exception:
+                    pass
 
-                    file_id = save_contact_to_wiki(parsed)
-                    if not file_id:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid, messages=[TextMessage(text="❌ 聯絡人儲存失敗，請稍後再試")]
-                            ))
-                        return
-
-                    info_lines = [f"✅ 已加入人脈資料庫\n", f"👤 {parsed['name']}"]
-                    if parsed.get("relation"):
-                        info_lines.append(f"🤝 {parsed['relation']}")
-                    if parsed.get("company"):
-                        company = parsed["company"]
-                        if parsed.get("role"):
-                            company += f"・{parsed['role']}"
-                        info_lines.append(f"🏢 {company}")
-                    if parsed.get("phone"):
-                        info_lines.append(f"📞 {parsed['phone']}")
-                    if parsed.get("email"):
-                        info_lines.append(f"✉️ {parsed['email']}")
-                    if parsed.get("notes"):
-                        info_lines.append(f"📝 {parsed['notes'][:80]}")
-
-                    with ApiClient(configuration) as push_client:
-                        MessagingApi(push_client).push_message(PushMessageRequest(
-                            to=uid,
-                            messages=[TextMessage(
-                                text="\n".join(info_lines),
-                                quick_reply=QuickReply(items=[
-                                    QuickReplyItem(action=MessageAction(label="再加一位", text="加聯絡人：")),
-                                    QuickReplyItem(action=MessageAction(label="🔍 搜尋人脈", text="查 ")),
-                                ])
-                            )]
-                        ))
-                except Exception as ex:
-                    print(f"[DEBUG] Add contact async error: {str(ex)}")
-                    try:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid, messages=[TextMessage(text="❌ 新增聯絡人失敗，請稍後再試")]
-                            ))
-                    except Exception:
-                        pass
+        background_executor.submit(_add_event_async, user_id, event_text)
+        return
 
-            threading.Thread(target=_add_contact_async, args=(user_id, contact_text), daemon=True).start()
-            return
+    # 加聯絡人指令：解析自然語言 → 存到 Wiki/People/
+    if command_type == "add_contact":
+        contact_text = command.group("contact_text").strip()
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(reply_token=event.reply_token,
+                messages=[TextMessage(text=f"👤 正在新增聯絡人...\n「{contact_text[:60]}」")])
+        )
 
-        # 問 XXX 指令：根據個人知識庫回答問題
-        ask_match = re.match(r'^(?:問|請問)\s+(.+)$', text.strip())
-        if ask_match:
-            question = ask_match.group(1).strip()
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"🧠 正在查詢你的知識庫...\n\n問題：{question}")]
-                )
-            )
+        def _add_contact_async(uid, ct_text):
+            try:
+                parsed = parse_contact_from_text(ct_text)
+                if not parsed:
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text="❌ 無法解析聯絡人資訊\n\n試試這個格式：\n加聯絡人：Jason 同事 ABC 公司工程師 0912345678 在 AWS 大會認識")]
+                    ))
+                    return
+
+                file_id = save_contact_to_wiki(parsed)
+                if not file_id:
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid, messages=[TextMessage(text="❌ 聯絡人儲存失敗，請稍後再試")]
+                    ))
+                    return
 
-            def _answer_async(uid, q):
+                info_lines = [f"✅ 已加入人脈資料庫\n", f"👤 {parsed['name']}"]
+                if parsed.get("relation"):
+                    info_lines.append(f"🤝 {parsed['relation']}")
+                if parsed.get("company"):
+                    company = parsed["company"]
+                    if parsed.get("role"):
+                        company += f"・{parsed['role']}"
+                    info_lines.append(f"🏢 {company}")
+                if parsed.get("phone"):
+                    info_lines.append(f"📞 {parsed['phone']}")
+                if parsed.get("email"):
+                    info_lines.append(f"✉️ {parsed['email']}")
+                if parsed.get("notes"):
+                    info_lines.append(f"📝 {parsed['notes'][:80]}")
+
+                line_messaging_api.push_message(PushMessageRequest(
+                    to=uid,
+                    messages=[TextMessage(
+                        text="\n".join(info_lines),
+                        quick_reply=QuickReply(items=[
+                            QuickReplyItem(action=MessageAction(label="再加一位", text="加聯絡人：")),
+                            QuickReplyItem(action=MessageAction(label="🔍 搜尋人脈", text="查 ")),
+                        ])
+                    )]
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Add contact async error: {str(ex)}")
                 try:
-                    wiki_matches = search_wiki_pages(q)
-                    source_matches = search_sources(q, limit=5)
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid, messages=[TextMessage(text="❌ 新增聯絡人失敗，請稍後再試")]
+                    ))
+                except Exception:
+                    pass
 
-                    wiki_docs = []
-                    for f in wiki_matches[:4]:
-                        content = read_gdrive_file(f['id'])
-                        if content:
-                            wiki_docs.append((f['name'], content))
+        background_executor.submit(_add_contact_async, user_id, contact_text)
+        return
 
-                    source_docs = []
-                    for f in source_matches[:4]:
-                        content = read_gdrive_file(f['id'])
-                        if content:
-                            source_docs.append((f['name'], content))
+    # 問 XXX 指令：根據個人知識庫回答問題
+    if command_type == "ask":
+        question = command.group("question").strip()
+        reply_text(event, f"🧠 正在查詢你的知識庫...\n\n問題：{question}")
 
-                    result = answer_from_knowledge_base(q, wiki_docs, source_docs)
-                    if not result:
-                        result = "❌ 回答生成失敗，請稍後再試"
+        def _answer_async(uid, q):
+            try:
+                wiki_matches = search_wiki_pages(q)
+                source_matches = search_sources(q, limit=5)
+
+                wiki_docs = []
+                for f in wiki_matches[:4]:
+                    content = read_gdrive_file(f['id'])
+                    if content:
+                        wiki_docs.append((f['name'], content))
+
+                source_docs = []
+                for f in source_matches[:4]:
+                    content = read_gdrive_file(f['id'])
+                    if content:
+                        source_docs.append((f['name'], content))
+
+                result = answer_from_knowledge_base(q, wiki_docs, source_docs)
+                if not result:
+                    result = "❌ 回答生成失敗，請稍後再試"
+
+                line_messaging_api.push_message(PushMessageRequest(
+                    to=uid,
+                    messages=[TextMessage(text=f"🧠 根據你的知識庫\n\n{result}")]
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Answer async error: {str(ex)}")
+                try:
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text="❌ 查詢失敗，請稍後再試")]
+                    ))
+                except Exception:
+                    pass
 
-                    with ApiClient(configuration) as push_client:
-                        MessagingApi(push_client).push_message(PushMessageRequest(
-                            to=uid,
-                            messages=[TextMessage(text=f"🧠 根據你的知識庫\n\n{result}")]
-                        ))
-                except Exception as ex:
-                    print(f"[DEBUG] Answer async error: {str(ex)}")
-                    try:
-                        with ApiClient(configuration) as push_client:
-                            MessagingApi(push_client).push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text="❌ 查詢失敗，請稍後再試")]
-                            ))
-                    except Exception:
-                        pass
+        background_executor.submit(_answer_async, user_id, question)
+        return
 
-            threading.Thread(target=_answer_async, args=(user_id, question), daemon=True).start()
-            return
+    # Check if user is in translation mode (waiting for content to translate)
+    state = user_states.get(user_id) or {}
+    if state.get("mode") == "translate_waiting":
+        target_language = state.get("target_language")
+        print(f"[DEBUG] User in translation mode, translating to: {target_language}")
 
-        # Check if user is in translation mode (waiting for content to translate)
-        if user_id in user_states and user_states[user_id].get("mode") == "translate_waiting":
-            target_language = user_states[user_id].get("target_language")
-            print(f"[DEBUG] User in translation mode, translating to: {target_language}")
-
-            # Check if user wants to exit translation mode
-            if text in ["取消", "離開", "結束", "exit", "cancel"]:
-                del user_states[user_id]
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="已離開翻譯模式 👋")],
-                    )
-                )
-                return
+        # Check if user wants to exit translation mode
+        if text in ["取消", "離開", "結束", "exit", "cancel"]:
+            pop_user_state(user_id)
+            reply_text(event, "已離開翻譯模式 👋")
+            return
 
-            # Check if user wants to switch language
-            if text in ["翻譯", "翻譯模式", "換語言", "切換語言"]:
-                user_states[user_id] = {"mode": "translate_select_language", "entered_at": time.time()}
-                quick_reply_items = [
-                    QuickReplyItem(action=MessageAction(label=label, text=label))
-                    for label, _ in QUICK_REPLY_LANGUAGES
-                ]
-                quick_reply_items.append(
-                    QuickReplyItem(action=MessageAction(label="❌ 取消", text="取消"))
-                )
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(
-                            text="🌐 切換語言\n\n請選擇要翻譯成的語言：\n\n💡 也可以直接輸入語言名稱（如：韓文、馬來文）",
-                            quick_reply=QuickReply(items=quick_reply_items)
-                        )],
-                    )
+        # Check if user wants to switch language
+        if text in ["翻譯", "翻譯模式", "換語言", "切換語言"]:
+            enter_user_mode(user_id, "translate_select_language")
+            line_messaging_api.reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[TextMessage(
+                        text="🌐 切換語言\n\n請選擇要翻譯成的語言：\n\n💡 也可以直接輸入語言名稱（如：韓文、馬來文）",
+                        quick_reply=LANGUAGE_QUICK_REPLY
+                    )],
                 )
-                return
+            )
+            return
 
-            # Translate the content
+        # Translate the content
+        def _translate_in_mode_async(evt, uid, src, lang):
             try:
-                translated = translate_text(text, target_language)
+                translated = translate_text(src, lang)
                 # Keep user in translation mode for continuous translation
                 # Reset timeout on each translation
-                user_states[user_id]["entered_at"] = time.time()
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(
-                            text=f"🌐 翻譯結果（{target_language}）\n\n{translated}\n\n─────────\n💡 繼續輸入文字可持續翻譯\n輸入「取消」離開翻譯模式",
-                            quick_reply=QuickReply(items=[
-                                QuickReplyItem(action=MessageAction(label="🚪 離開翻譯模式", text="取消")),
-                                QuickReplyItem(action=MessageAction(label="🔄 切換語言", text="切換語言")),
-                            ])
-                        )],
-                    )
-                )
+                touch_user_mode(uid)
+                reply_or_push(evt, [TextMessage(
+                    text=f"🌐 翻譯結果（{lang}）\n\n{translated}\n\n─────────\n💡 繼續輸入文字可持續翻譯\n輸入「取消」離開翻譯模式",
+                    quick_reply=TRANSLATION_MODE_QUICK_REPLY
+                )])
                 print(f"[DEBUG] Translation in mode sent successfully")
 
-                # Save to Notion
-                save_to_gdrive(
-                    title=f"翻譯：{text[:50]}...",
+                # Save to Google Drive
+                queue_gdrive_save(
+                    title=f"翻譯：{src[:50]}...",
                     content_type="翻譯",
                     category="翻譯",
                     content=translated,
-                    original_text=text,
-                    target_language=target_language,
-                    user_id=user_id,
+                    original_text=src,
+                    target_language=lang,
+                    user_id=uid,
                     source_type="text",
                     capture_status=CAPTURE_STATUS_FULL,
                     extractor="line-translation",
-                    raw_input=text,
-                    normalized_input=normalize_input_light(text),
-                )
-            except Exception as e:
-                print(f"[DEBUG] Translation error: {str(e)}")
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="❌ 翻譯失敗，請稍後再試")],
-                    )
-                )
-            return
-
-        # Check if user selected a language from Quick Reply
-        if user_id in user_states and user_states[user_id].get("mode") == "translate_select_language":
-            # Check if the input matches a language
-            selected_language = LANGUAGE_MAP.get(text)
-            if selected_language:
-                user_states[user_id] = {"mode": "translate_waiting", "target_language": selected_language, "entered_at": time.time()}
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=f"✅ 已選擇翻譯成【{text}】\n\n請輸入要翻譯的內容：\n\n💡 輸入「取消」可離開翻譯模式")],
-                    )
-                )
-                print(f"[DEBUG] Language selected: {selected_language}")
-                return
-            # If input doesn't match a language, treat it as content to translate with default
-            # Or show error - let's show the language selection again
-            if text in ["取消", "離開", "結束", "exit", "cancel"]:
-                del user_states[user_id]
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="已離開翻譯模式 👋")],
-                    )
-                )
-                return
-
-            # Check if it's a valid language name not in our quick reply but in the map
-            for lang_name, lang_code in LANGUAGE_MAP.items():
-                if text == lang_name:
-                    user_states[user_id] = {"mode": "translate_waiting", "target_language": lang_code, "entered_at": time.time()}
-                    line_bot_api.reply_message_with_http_info(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text=f"✅ 已選擇翻譯成【{text}】\n\n請輸入要翻譯的內容：\n\n💡 輸入「取消」可離開翻譯模式")],
-                        )
-                    )
-                    return
-
-            # No matching language found - show error and re-display language selection
-            quick_reply_items = [
-                QuickReplyItem(action=MessageAction(label=label, text=label))
-                for label, _ in QUICK_REPLY_LANGUAGES
-            ]
-            quick_reply_items.append(
-                QuickReplyItem(action=MessageAction(label="❌ 取消", text="取消"))
-            )
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(
-                        text=f"❌ 找不到「{text}」這個語言\n\n請從下方選擇，或直接輸入語言名稱（如：韓文、馬來文）：",
-                        quick_reply=QuickReply(items=quick_reply_items)
-                    )],
+                    raw_input=src,
+                    normalized_input=normalize_input_light(src),
                 )
-            )
-            return
-
-        # Check if user wants to enter translation mode (just "翻譯" or "翻譯模式")
-        if text in ["翻譯", "翻譯模式"]:
-            user_states[user_id] = {"mode": "translate_select_language", "entered_at": time.time()}
-            quick_reply_items = [
-                QuickReplyItem(action=MessageAction(label=label, text=label))
-                for label, _ in QUICK_REPLY_LANGUAGES
-            ]
-            # Add cancel option
-            quick_reply_items.append(
-                QuickReplyItem(action=MessageAction(label="❌ 取消", text="取消"))
-            )
+            except Exception as ex:
+                print(f"[DEBUG] Translation error: {str(ex)}")
+                try:
+                    reply_or_push(evt, [TextMessage(text="❌ 翻譯失敗，請稍後再試")])
+                except Exception:
+                    pass
 
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(
-                        text="🌐 翻譯模式\n\n請選擇要翻譯成的語言：\n\n💡 也可以直接輸入語言名稱（如：韓文、馬來文）",
-                        quick_reply=QuickReply(items=quick_reply_items)
-                    )],
-                )
-            )
-            print(f"[DEBUG] Entered translation mode, showing language selection")
+        show_loading_animation(event)
+        background_executor.submit(_translate_in_mode_async, event, user_id, text, target_language)
+        return
+
+    # Check if user selected a language from Quick Reply
+    if (user_states.get(user_id) or {}).get("mode") == "translate_select_language":
+        # Check if the input matches a language
+        selected_language = LANGUAGE_MAP.get(text)
+        if selected_language:
+            enter_user_mode(user_id, "translate_waiting", target_language=selected_language)
+            reply_text(event, f"✅ 已選擇翻譯成【{text}】\n\n請輸入要翻譯的內容：\n\n💡 輸入「取消」可離開翻譯模式")
+            print(f"[DEBUG] Language selected: {selected_language}")
             return
-
-        # Check if user wants to cancel (outside of translation mode)
+        # If input doesn't match a language, treat it as content to translate with default
+        # Or show error - let's show the language selection again
         if text in ["取消", "離開", "結束", "exit", "cancel"]:
-            if user_id in user_states:
-                del user_states[user_id]
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="已取消 👋")],
-                )
-            )
+            pop_user_state(user_id)
+            reply_text(event, "已離開翻譯模式 👋")
             return
 
-        # Check if message is a direct translation request (翻譯成英文：你好)
-        translation_request = parse_translation_request(text)
-        if translation_request:
-            target_language, text_to_translate = translation_request
-            print(f"[DEBUG] Translation request - Language: {target_language}, Text: {text_to_translate[:50]}...")
-
+        # No matching language found - show error and re-display language selection
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[TextMessage(
+                    text=f"❌ 找不到「{text}」這個語言\n\n請從下方選擇，或直接輸入語言名稱（如：韓文、馬來文）：",
+                    quick_reply=LANGUAGE_QUICK_REPLY
+                )],
+            )
+        )
+        return
+
+    # Check if user wants to enter translation mode (just "翻譯" or "翻譯模式")
+    if text in ["翻譯", "翻譯模式"]:
+        enter_user_mode(user_id, "translate_select_language")
+        line_messaging_api.reply_message_with_http_info(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[TextMessage(
+                    text="🌐 翻譯模式\n\n請選擇要翻譯成的語言：\n\n💡 也可以直接輸入語言名稱（如：韓文、馬來文）",
+                    quick_reply=LANGUAGE_QUICK_REPLY
+                )],
+            )
+        )
+        print(f"[DEBUG] Entered translation mode, showing language selection")
+        return
+
+    # Check if user wants to cancel (outside of translation mode)
+    if text in ["取消", "離開", "結束", "exit", "cancel"]:
+        pop_user_state(user_id)
+        reply_text(event, "已取消 👋")
+        return
+
+    # Check if message is a direct translation request (翻譯成英文：你好)
+    translation_request = parse_translation_request(text)
+    if translation_request:
+        target_language, text_to_translate = translation_request
+        print(f"[DEBUG] Translation request - Language: {target_language}, Text: {text_to_translate[:50]}...")
+
+        def _translate_async(evt, uid, src, lang):
             try:
-                translated = translate_text(text_to_translate, target_language)
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=f"🌐 翻譯結果（{target_language}）\n\n{translated}")],
-                    )
-                )
+                translated = translate_text(src, lang)
+                reply_or_push(evt, [TextMessage(text=f"🌐 翻譯結果（{lang}）\n\n{translated}")])
                 print(f"[DEBUG] Translation sent successfully")
 
-                # Save to Notion
-                save_to_gdrive(
-                    title=f"翻譯：{text_to_translate[:50]}...",
+                # Save to Google Drive
+                queue_gdrive_save(
+                    title=f"翻譯：{src[:50]}...",
                     content_type="翻譯",
                     category="翻譯",
                     content=translated,
-                    original_text=text_to_translate,
-                    target_language=target_language,
-                    user_id=user_id,
+                    original_text=src,
+                    target_language=lang,
+                    user_id=uid,
                     source_type="text",
                     capture_status=CAPTURE_STATUS_FULL,
                     extractor="line-translation",
-                    raw_input=text_to_translate,
-                    normalized_input=normalize_input_light(text_to_translate),
-                )
-            except Exception as e:
-                print(f"[DEBUG] Translation error: {str(e)}")
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="❌ 翻譯失敗，請稍後再試")],
-                    )
-                )
-            return
-
-        # Check if user is in scrape_waiting_count mode (waiting for post count)
-        if user_id in user_states and user_states[user_id].get("mode") == "scrape_waiting_count":
-            state = user_states[user_id]
-            url = state.get("url")
-            platform = state.get("platform")
-
-            # Check for cancel
-            if text in ["取消", "離開", "結束", "exit", "cancel"]:
-                del user_states[user_id]
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="已取消爬取 👋")],
-                    )
+                    raw_input=src,
+                    normalized_input=normalize_input_light(src),
                 )
-                return
-
-            # Check if input is a number
-            if text.isdigit():
-                max_posts = min(int(text), 20)  # Cap at 20
-                del user_states[user_id]  # Clear state
-
-                if not apify_client:
-                    line_bot_api.reply_message_with_http_info(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text="❌ 社群爬蟲功能未設定，請設定 APIFY_API_KEY")],
-                        )
-                    )
-                    return
-
-                # Send initial response with clear wait time expectation
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=f"🔄 開始爬取 {max_posts} 篇貼文\n\n⏱️ 預計需要 2-5 分鐘\n📱 完成後會自動通知你\n\n請耐心等候，不需要重複發送...")],
-                    )
-                )
-
-                # Scrape multiple posts
-                posts = scrape_facebook_post(url, max_posts) if platform == "facebook" else scrape_threads_post(url, max_posts)
-
-                if not posts:
-                    with ApiClient(configuration) as api_client2:
-                        messaging_api2 = MessagingApi(api_client2)
-                        messaging_api2.push_message(
-                            PushMessageRequest(
-                                to=user_id,
-                                messages=[TextMessage(text=f"❌ 無法爬取貼文，可能是私人帳號或網址無效")]
-                            )
-                        )
-                    return
+            except Exception as ex:
+                print(f"[DEBUG] Translation error: {str(ex)}")
+                try:
+                    reply_or_push(evt, [TextMessage(text="❌ 翻譯失敗，請稍後再試")])
+                except Exception:
+                    pass
 
-                # Process each post
-                saved_count = 0
+        show_loading_animation(event)
+        background_executor.submit(_translate_async, event, user_id, text_to_translate, target_language)
+        return
 
-                for i, post_data in enumerate(posts):
-                    try:
-                        print(f"[DEBUG] Processing post {i+1}, raw data keys: {post_data.keys()}")
-                        normalized_data = normalize_social_post_data(post_data, platform)
-                        print(f"[DEBUG] Normalized: likes={normalized_data.get('likes')}, comments={normalized_data.get('comments')}")
+    # Check if user is in scrape_waiting_count mode (waiting for post count)
+    state = user_states.get(user_id) or {}
+    if state.get("mode") == "scrape_waiting_count":
+        url = state.get("url")
+        platform = state.get("platform")
 
-                        post_url = post_data.get("url") or post_data.get("postUrl") or url
-
-                        fid, _capture = save_normalized_social_post(
-                            platform=platform,
-                            normalized_data=normalized_data,
-                            source_url=post_url,
-                            raw_input=url,
-                            user_id=user_id,
-                        )
-                        if fid:
-                            saved_count += 1
-                    except Exception as e:
-                        print(f"[DEBUG] Error processing post {i+1}: {str(e)}")
-
-                # Send completion message
-                with ApiClient(configuration) as api_client2:
-                    messaging_api2 = MessagingApi(api_client2)
-                    messaging_api2.push_message(
-                        PushMessageRequest(
-                            to=user_id,
-                                messages=[TextMessage(text=f"✅ 完成！已爬取 {len(posts)} 篇貼文，成功存入 Obsidian {saved_count} 篇")]
-                        )
-                    )
-                return
+        # Check for cancel
+        if text in ["取消", "離開", "結束", "exit", "cancel"]:
+            pop_user_state(user_id)
+            reply_text(event, "已取消爬取 👋")
+            return
 
-        # Check for multi-post scraping command: "爬 5 篇 [URL]"
-        multi_match = SCRAPE_MULTI_PATTERN.match(text)
-        if multi_match:
-            max_posts = min(int(multi_match.group(1)), 20)  # Cap at 20 posts
-            url = multi_match.group(2)
-            print(f"[DEBUG] Multi-post scraping: {max_posts} posts from {url}")
+        # Check if input is a number
+        if text.isdigit():
+            max_posts = min(int(text), 20)  # Cap at 20
+            pop_user_state(user_id)  # Clear state
 
             if not apify_client:
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="❌ 社群爬蟲功能未設定，請設定 APIFY_API_KEY")],
-                    )
-                )
+                reply_text(event, "❌ 社群爬蟲功能未設定，請設定 APIFY_API_KEY")
                 return
 
-            platform, url_type = detect_social_platform(url)
-            if not platform:
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="❌ 不支援的網址格式，請提供 Facebook 或 Threads 網址")],
-                    )
-                )
-                return
-
-            # Send initial response
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"🔄 開始爬取 {max_posts} 篇貼文\n\n⏱️ 預計需要 2-5 分鐘\n📱 完成後會自動通知你\n\n請耐心等候，不需要重複發送...")],
-                )
-            )
-
-            # Scrape multiple posts
-            if platform == "facebook":
-                posts = scrape_facebook_post(url, max_posts)
-            else:
-                posts = scrape_threads_post(url, max_posts)
-
-            if not posts:
-                # Use push message since we already replied
-                with ApiClient(configuration) as api_client2:
-                    messaging_api2 = MessagingApi(api_client2)
-                    messaging_api2.push_message(
-                        PushMessageRequest(
-                            to=user_id,
-                            messages=[TextMessage(text=f"❌ 無法爬取貼文，可能是私人帳號或網址無效")]
-                        )
-                    )
-                return
+            # Send initial response with clear wait time expectation
+            reply_text(event, f"🔄 開始爬取 {max_posts} 篇貼文\n\n⏱️ 預計需要 2-5 分鐘\n📱 完成後會自動通知你\n\n請耐心等候，不需要重複發送...")
 
-            # Process each post
-            saved_count = 0
+            background_executor.submit(scrape_social_posts_async, user_id, url, platform, max_posts, url)
+            return
 
-            for i, post_data in enumerate(posts):
-                try:
-                    normalized_data = normalize_social_post_data(post_data, platform)
+    # Check for multi-post scraping command: "爬 5 篇 [URL]"
+    multi_match = SCRAPE_MULTI_PATTERN.match(text)
+    if multi_match:
+        max_posts = min(int(multi_match.group(1)), 20)  # Cap at 20 posts
+        url = multi_match.group(2)
+        print(f"[DEBUG] Multi-post scraping: {max_posts} posts from {url}")
 
-                    # Get post URL if available
-                    post_url = post_data.get("url") or post_data.get("postUrl") or url
+        if not apify_client:
+            reply_text(event, "❌ 社群爬蟲功能未設定，請設定 APIFY_API_KEY")
+            return
 
-                    fid, _capture = save_normalized_social_post(
-                        platform=platform,
-                        normalized_data=normalized_data,
-                        source_url=post_url,
-                        raw_input=text,
-                        user_id=user_id,
-                    )
-                    if fid:
-                        saved_count += 1
-                        print(f"[DEBUG] Saved post {i+1}/{len(posts)}")
-                except Exception as e:
-                    print(f"[DEBUG] Error processing post {i+1}: {str(e)}")
-
-            # Send completion message
-            with ApiClient(configuration) as api_client2:
-                messaging_api2 = MessagingApi(api_client2)
-                messaging_api2.push_message(
-                    PushMessageRequest(
-                        to=user_id,
-                        messages=[TextMessage(text=f"✅ 完成！已爬取 {len(posts)} 篇貼文，成功存入 Obsidian {saved_count} 篇")]
-                    )
-                )
+        platform, url_type = detect_social_platform(url)
+        if not platform:
+            reply_text(event, "❌ 不支援的網址格式，請提供 Facebook 或 Threads 網址")
             return
 
-        # Check if message contains a URL
-        url = extract_url(text)
-        print(f"[DEBUG] Extracted URL: {url}")
+        # Send initial response
+        reply_text(event, f"🔄 開始爬取 {max_posts} 篇貼文\n\n⏱️ 預計需要 2-5 分鐘\n📱 完成後會自動通知你\n\n請耐心等候，不需要重複發送...")
 
-        if url:
-            try:
-                source_type = source_type_from_url(url)
-                # Priority 1: Check if it's a social media URL (Facebook or Threads)
-                platform, url_type = detect_social_platform(url)
-                if platform:
-                    print(f"[DEBUG] Detected {platform} {url_type} URL, scraping post...")
-                    extractor = social_extractor_name(platform)
-
-                    # Check if Apify is configured
-                    if not apify_client:
-                        note = build_capture_status_note(
-                            url=url,
-                            raw_input=text,
-                            source_type=platform,
-                            extractor=extractor,
-                            status=CAPTURE_STATUS_FAILED,
-                            reason="apify_not_configured",
-                        )
-                        save_to_gdrive(
-                            title=f"{platform} 貼文抓取失敗",
-                            content_type="URL摘要",
-                            category="其他",
-                            content=note,
-                            source_url=url,
-                            keywords=[platform, "抓取失敗"],
-                            user_id=user_id,
-                            source_type=platform,
-                            capture_status=CAPTURE_STATUS_FAILED,
-                            extractor=extractor,
-                            needs_review=True,
-                            raw_input=text,
-                            normalized_input=normalize_input_light(text),
-                        )
-                        line_bot_api.reply_message_with_http_info(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text="社群抓取尚未設定，已先把網址存成待確認筆記。")],
-                            )
-                        )
-                        return
-
-                    # If it's a page URL, ask user how many posts to scrape
-                    if url_type == "page":
-                        # Store state for waiting scrape count
-                        user_states[user_id] = {
-                            "mode": "scrape_waiting_count",
-                            "url": url,
-                            "platform": platform,
-                            "entered_at": time.time()
-                        }
-                        platform_emoji = "📘" if platform == "facebook" else "🧵"
-                        platform_label = "Facebook 粉專/個人頁面" if platform == "facebook" else "Threads 個人頁面"
-                        line_bot_api.reply_message_with_http_info(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(
-                                    text=f"{platform_emoji} 偵測到 {platform_label}\n\n請選擇要爬取幾篇貼文：",
-                                    quick_reply=QuickReply(items=[
-                                        QuickReplyItem(action=MessageAction(label="3 篇", text="3")),
-                                        QuickReplyItem(action=MessageAction(label="5 篇", text="5")),
-                                        QuickReplyItem(action=MessageAction(label="10 篇", text="10")),
-                                        QuickReplyItem(action=MessageAction(label="20 篇", text="20")),
-                                        QuickReplyItem(action=MessageAction(label="❌ 取消", text="取消")),
-                                    ])
-                                )],
-                            )
-                        )
-                        return
-
-                    # Single post - scrape and analyze
-                    posts = scrape_facebook_post(url, 1) if platform == "facebook" else scrape_threads_post(url, 1)
-
-                    if not posts:
-                        note = build_capture_status_note(
-                            url=url,
-                            raw_input=text,
-                            source_type=platform,
-                            extractor=extractor,
-                            status=CAPTURE_STATUS_FAILED,
-                            reason="no_posts_returned",
-                        )
-                        fid = save_to_gdrive(
-                            title=f"{platform} 貼文抓取失敗",
-                            content_type="URL摘要",
-                            category="其他",
-                            content=note,
-                            source_url=url,
-                            keywords=[platform, "抓取失敗"],
-                            user_id=user_id,
-                            source_type=platform,
-                            capture_status=CAPTURE_STATUS_FAILED,
-                            extractor=extractor,
-                            needs_review=True,
-                            raw_input=text,
-                            normalized_input=normalize_input_light(text),
-                        )
-                        if fid:
-                            user_last_file[user_id] = {"file_id": fid, "title": f"{platform} 貼文抓取失敗", "saved_at": time.time()}
-                        line_bot_api.reply_message_with_http_info(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"無法爬取 {platform.title()} 貼文，已先存成待確認筆記。")],
-                            )
-                        )
-                        return
+        background_executor.submit(scrape_social_posts_async, user_id, url, platform, max_posts, text)
+        return
 
-                    post_data = posts[0]
+    # Check if message contains a URL
+    url = extract_url(text)
+    print(f"[DEBUG] Extracted URL: {url}")
 
-                    # Normalize data
-                    normalized_data = normalize_social_post_data(post_data, platform)
-                    print(f"[DEBUG] Normalized data: {normalized_data}")
+    if url:
+        try:
+            source_type = source_type_from_url(url)
+            # Priority 1: Check if it's a social media URL (Facebook or Threads)
+            platform, url_type = detect_social_platform(url)
+            if platform:
+                print(f"[DEBUG] Detected {platform} {url_type} URL, scraping post...")
+                extractor = social_extractor_name(platform)
 
-                    # Build response message
-                    platform_emoji = "📘" if platform == "facebook" else "🧵"
-                    platform_name = platform_display_name(platform)
-                    fid, capture = save_normalized_social_post(
-                        platform=platform,
-                        normalized_data=normalized_data,
-                        source_url=url,
+                # Check if Apify is configured
+                if not apify_client:
+                    note = build_capture_status_note(
+                        url=url,
                         raw_input=text,
+                        source_type=platform,
+                        extractor=extractor,
+                        status=CAPTURE_STATUS_FAILED,
+                        reason="apify_not_configured",
+                    )
+                    queue_gdrive_save(
+                        title=f"{platform} 貼文抓取失敗",
+                        content_type="URL摘要",
+                        category="其他",
+                        content=note,
+                        source_url=url,
+                        keywords=[platform, "抓取失敗"],
                         user_id=user_id,
+                        source_type=platform,
+                        capture_status=CAPTURE_STATUS_FAILED,
+                        extractor=extractor,
+                        needs_review=True,
+                        raw_input=text,
+                        normalized_input=normalize_input_light(text),
                     )
-                    quality = capture["quality"]
-
-                    response_text = f"{platform_emoji} {platform_name} 貼文已保存\n抓取狀態：{quality['status']}\n\n{capture['summary']}"
+                    reply_text(event, "社群抓取尚未設定，已先把網址存成待確認筆記。")
+                    return
 
-                    line_bot_api.reply_message_with_http_info(
+                # If it's a page URL, ask user how many posts to scrape
+                if url_type == "page":
+                    # Store state for waiting scrape count
+                    enter_user_mode(user_id, "scrape_waiting_count", url=url, platform=platform)
+                    platform_emoji = "📘" if platform == "facebook" else "🧵"
+                    platform_label = "Facebook 粉專/個人頁面" if platform == "facebook" else "Threads 個人頁面"
+                    line_messaging_api.reply_message_with_http_info(
                         ReplyMessageRequest(
                             reply_token=event.reply_token,
-                            messages=[TextMessage(text=response_text)],
+                            messages=[TextMessage(
+                                text=f"{platform_emoji} 偵測到 {platform_label}\n\n請選擇要爬取幾篇貼文：",
+                                quick_reply=QuickReply(items=[
+                                    QuickReplyItem(action=MessageAction(label="3 篇", text="3")),
+                                    QuickReplyItem(action=MessageAction(label="5 篇", text="5")),
+                                    QuickReplyItem(action=MessageAction(label="10 篇", text="10")),
+                                    QuickReplyItem(action=MessageAction(label="20 篇", text="20")),
+                                    QuickReplyItem(action=MessageAction(label="❌ 取消", text="取消")),
+                                ])
+                            )],
                         )
                     )
-                    print(f"[DEBUG] Social post analysis sent successfully")
-
-                    if fid:
-                        user_last_file[user_id] = {"file_id": fid, "title": capture["title"], "saved_at": time.time()}
                     return
 
-                # Priority 2+3: Google Maps or general webpage
-                is_google_maps = source_type == "google_maps"
+                # Single post - scrape and analyze
+                def _process_social_post_async(evt, uid, u, plat, raw):
+                    try:
+                        extractor = social_extractor_name(plat)
+                        posts = scrape_facebook_post(u, 1) if plat == "facebook" else scrape_threads_post(u, 1)
+
+                        if not posts:
+                            note = build_capture_status_note(
+                                url=u,
+                                raw_input=raw,
+                                source_type=plat,
+                                extractor=extractor,
+                                status=CAPTURE_STATUS_FAILED,
+                                reason="no_posts_returned",
+                            )
+                            _save_and_remember_last_file(dict(
+                                title=f"{plat} 貼文抓取失敗",
+                                content_type="URL摘要",
+                                category="其他",
+                                content=note,
+                                source_url=u,
+                                keywords=[plat, "抓取失敗"],
+                                user_id=uid,
+                                source_type=plat,
+                                capture_status=CAPTURE_STATUS_FAILED,
+                                extractor=extractor,
+                                needs_review=True,
+                                raw_input=raw,
+                                normalized_input=normalize_input_light(raw),
+                            ))
+                            reply_or_push(evt, [TextMessage(text=f"無法爬取 {plat.title()} 貼文，已先存成待確認筆記。")])
+                            return
+
+                        # Normalize data
+                        normalized_data = normalize_social_post_data(posts[0], plat)
+                        print(f"[DEBUG] Normalized data: {normalized_data}")
+
+                        # Build response message
+                        platform_emoji = "📘" if plat == "facebook" else "🧵"
+                        platform_name = platform_display_name(plat)
+                        fid, capture = save_normalized_social_post(
+                            platform=plat,
+                            normalized_data=normalized_data,
+                            source_url=u,
+                            raw_input=raw,
+                            user_id=uid,
+                        )
+                        if fid:
+                            user_last_file[uid] = {"file_id": fid, "title": capture["title"], "saved_at": time.time()}
+                        quality = capture["quality"]
 
-                # Send immediate waiting message (Jina AI + GPT can take 10-20s)
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=f"🔗 正在讀取網頁摘要...\n（通常需要 10-20 秒）")]
-                    )
-                )
+                        response_text = f"{platform_emoji} {platform_name} 貼文已保存\n抓取狀態：{quality['status']}\n\n{capture['summary']}"
+                        reply_or_push(evt, [TextMessage(text=response_text)])
+                        print(f"[DEBUG] Social post analysis sent successfully")
+                    except Exception as ex:
+                        print(f"[DEBUG] Social post async error: {str(ex)}")
+                        try:
+                            reply_or_push(evt, [TextMessage(text="❌ 處理失敗，請稍後再試")])
+                        except Exception:
+                            pass
 
-                def _process_url_async(uid, u, maps):
-                    try:
-                        if maps:
-                            print(f"[DEBUG] Detected Google Maps URL, trying Apify scraper first...")
-                            resolved_url = resolve_short_url(u)
-                            place_data = scrape_google_maps(resolved_url)
-                            if place_data:
-                                scraped_info = format_google_maps_result(place_data)
-                                extractor = "google-maps-apify"
-                                quality = assess_google_maps_place_data(place_data)
-                                if should_save_status_note_only("google_maps", quality["status"]):
-                                    page_summary = build_capture_status_note(
-                                        url=resolved_url,
-                                        raw_input=text,
-                                        source_type="google_maps",
-                                        extractor=extractor,
-                                        status=quality["status"],
-                                        reason=quality["reason"],
-                                        extracted_content=scraped_info,
-                                    )
-                                else:
-                                    page_summary = summarize_google_maps(scraped_info, resolved_url)
+                show_loading_animation(event)
+                submit_last_file_task(user_id, _process_social_post_async, event, user_id, url, platform, text)
+                return
+
+            # Priority 2+3: Google Maps or general webpage
+            is_google_maps = source_type == "google_maps"
+
+            # Send immediate waiting message (Jina AI + GPT can take 10-20s)
+            reply_text(event, f"🔗 正在讀取網頁摘要...\n（通常需要 10-20 秒）")
+
+            def _process_url_async(uid, u, maps):
+                try:
+                    cached = get_cached_url_summary(u)
+                    if cached:
+                        print(f"[DEBUG] URL summary cache hit: {u}")
+                        page_summary, extractor, quality = cached
+                    elif maps:
+                        print(f"[DEBUG] Detected Google Maps URL, trying Apify scraper first...")
+                        resolved_url = resolve_short_url(u)
+                        place_data = scrape_google_maps(resolved_url)
+                        if place_data:
+                            scraped_info = format_google_maps_result(place_data)
+                            extractor = "google-maps-apify"
+                            quality = assess_google_maps_place_data(place_data)
+                            if should_save_status_note_only("google_maps", quality["status"]):
+                                page_summary = build_capture_status_note(
+                                    url=resolved_url,
+                                    raw_input=text,
+                                    source_type="google_maps",
+                                    extractor=extractor,
+                                    status=quality["status"],
+                                    reason=quality["reason"],
+                                    extracted_content=scraped_info,
+                                )
                             else:
-                                print(f"[DEBUG] Apify scraper failed, falling back to webpage fetch...")
-                                page_content = fetch_webpage_content(resolved_url)
-                                extractor = "jina"
-                                quality = assess_extracted_content(page_content)
-                                if should_save_status_note_only("google_maps", quality["status"]):
-                                    page_summary = build_capture_status_note(
-                                        url=resolved_url,
-                                        raw_input=text,
-                                        source_type="google_maps",
-                                        extractor=extractor,
-                                        status=quality["status"],
-                                        reason=quality["reason"],
-                                        extracted_content=page_content,
-                                    )
-                                else:
-                                    page_summary = summarize_google_maps(page_content, resolved_url)
+                                page_summary = summarize_google_maps(scraped_info, resolved_url)
                         else:
-                            print(f"[DEBUG] Fetching webpage content...")
-                            source_type_inner = source_type_from_url(u)
-                            page_content, extractor = fetch_content_by_source_type(u, source_type_inner)
-                            print(f"[DEBUG] Content length: {len(page_content)}")
-                            quality = assess_url_capture_quality(page_content, source_type_inner, extractor)
-                            if should_save_status_note_only(source_type_inner, quality["status"]):
+                            print(f"[DEBUG] Apify scraper failed, falling back to webpage fetch...")
+                            page_content = fetch_webpage_content(resolved_url)
+                            extractor = "jina"
+                            quality = assess_extracted_content(page_content)
+                            if should_save_status_note_only("google_maps", quality["status"]):
                                 page_summary = build_capture_status_note(
-                                    url=u,
+                                    url=resolved_url,
                                     raw_input=text,
-                                    source_type=source_type_inner,
+                                    source_type="google_maps",
                                     extractor=extractor,
                                     status=quality["status"],
                                     reason=quality["reason"],
                                     extracted_content=page_content,
                                 )
                             else:
-                                page_summary = summarize_webpage(page_content)
-
-                        print(f"[DEBUG] Summary: {page_summary[:100]}...")
-                        parsed_url = parse_summary_response(page_summary)
-                        title = parsed_url["title"] or u[:50]
-                        url_source_type = source_type_from_url(u)
-                        fid = save_to_gdrive(
-                            title=title,
-                            content_type="URL摘要",
-                            category=parsed_url["category"],
-                            content=page_summary,
-                            source_url=u,
-                            keywords=parsed_url["keywords"],
-                            user_id=uid,
-                            source_type=url_source_type,
-                            capture_status=quality["status"],
-                            extractor=extractor,
-                            needs_review=quality["needs_review"],
-                            raw_input=text,
-                            normalized_input=normalize_input_light(text),
-                        )
-                        if fid:
-                            user_last_file[uid] = {"file_id": fid, "title": title, "saved_at": time.time()}
-
-                        with ApiClient(configuration) as push_client:
-                            push_api = MessagingApi(push_client)
-                            push_api.push_message(PushMessageRequest(
-                                to=uid,
-                                messages=[TextMessage(text=build_url_capture_push_message(
-                                    fid,
-                                    quality["status"],
-                                    url_source_type,
-                                    parsed_url["title"],
-                                ))]
-                            ))
-                        print(f"[DEBUG] URL summary pushed successfully")
-                    except Exception as ex:
-                        print(f"[DEBUG] Async URL error: {str(ex)}")
-                        try:
-                            with ApiClient(configuration) as push_client:
-                                push_api = MessagingApi(push_client)
-                                push_api.push_message(PushMessageRequest(
-                                    to=uid,
-                                    messages=[TextMessage(text="❌ 無法讀取網頁，請確認網址是否正確")]
-                                ))
-                        except Exception:
-                            pass
-
-                threading.Thread(target=_process_url_async, args=(user_id, url, is_google_maps), daemon=True).start()
-            except Exception as e:
-                print(f"[DEBUG] Error: {str(e)}")
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="❌ 處理失敗，請稍後再試")],
+                                page_summary = summarize_google_maps(page_content, resolved_url)
+                    else:
+                        print(f"[DEBUG] Fetching webpage content...")
+                        source_type_inner = source_type_from_url(u)
+                        page_content, extractor = fetch_content_by_source_type(u, source_type_inner)
+                        print(f"[DEBUG] Content length: {len(page_content)}")
+                        quality = assess_url_capture_quality(page_content, source_type_inner, extractor)
+                        if should_save_status_note_only(source_type_inner, quality["status"]):
+                            page_summary = build_capture_status_note(
+                                url=u,
+                                raw_input=text,
+                                source_type=source_type_inner,
+                                extractor=extractor,
+                                status=quality["status"],
+                                reason=quality["reason"],
+                                extracted_content=page_content,
+                            )
+                        else:
+                            page_summary = summarize_webpage(page_content)
+
+                    if not cached and quality["status"] == CAPTURE_STATUS_FULL:
+                        cache_url_summary(u, (page_summary, extractor, quality))
+
+                    print(f"[DEBUG] Summary: {page_summary[:100]}...")
+                    parsed_url = parse_summary_response(page_summary)
+                    title = parsed_url["title"] or u[:50]
+                    url_source_type = source_type_from_url(u)
+                    fid = save_to_gdrive(
+                        title=title,
+                        content_type="URL摘要",
+                        category=parsed_url["category"],
+                        content=page_summary,
+                        source_url=u,
+                        keywords=parsed_url["keywords"],
+                        user_id=uid,
+                        source_type=url_source_type,
+                        capture_status=quality["status"],
+                        extractor=extractor,
+                        needs_review=quality["needs_review"],
+                        raw_input=text,
+                        normalized_input=normalize_input_light(text),
                     )
-                )
-        else:
-            # Summarize the text
-            print(f"[DEBUG] Generating text summary...")
+                    if fid:
+                        user_last_file[uid] = {"file_id": fid, "title": title, "saved_at": time.time()}
+
+                    line_messaging_api.push_message(PushMessageRequest(
+                        to=uid,
+                        messages=[TextMessage(text=build_url_capture_push_message(
+                            fid,
+                            quality["status"],
+                            url_source_type,
+                            parsed_url["title"],
+                        ))]
+                    ))
+                    print(f"[DEBUG] URL summary pushed successfully")
+                except Exception as ex:
+                    print(f"[DEBUG] Async URL error: {str(ex)}")
+                    try:
+                        line_messaging_api.push_message(PushMessageRequest(
+                            to=uid,
+                            messages=[TextMessage(text="❌ 無法讀取網頁，請確認網址是否正確")]
+                        ))
+                    except Exception:
+                        pass
+
+            submit_last_file_task(user_id, _process_url_async, user_id, url, is_google_maps)
+        except Exception as e:
+            print(f"[DEBUG] Error: {str(e)}")
+            reply_text(event, "❌ 處理失敗，請稍後再試")
+    else:
+        # Summarize the text
+        print(f"[DEBUG] Generating text summary...")
+
+        def _summarize_text_async(evt, uid, src):
             try:
-                summary = summarize_text(text)
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=f"📝 文字摘要\n\n{summary}")],
-                    )
-                )
+                summary = summarize_text(src)
+                reply_or_push(evt, [TextMessage(text=f"📝 文字摘要\n\n{summary}")])
+                print(f"[DEBUG] Text summary sent successfully")
+
                 parsed = parse_summary_response(summary)
-                title = parsed["title"] or text[:30]
-                file_id = save_to_gdrive(
-                    title=title,
+                _save_and_remember_last_file(dict(
+                    title=parsed["title"] or src[:30],
                     content_type="文字筆記",
                     category=parsed["category"],
-                    content=f"{summary}\n\n## 原始輸入\n{text}",
+                    content=f"{summary}\n\n## 原始輸入\n{src}",
                     keywords=parsed["keywords"],
-                    user_id=user_id,
+                    user_id=uid,
                     source_type="text",
                     capture_status=CAPTURE_STATUS_FULL,
                     extractor="line-text",
                     needs_review=False,
-                    raw_input=text,
-                    normalized_input=normalize_input_light(text),
-                )
-                if file_id:
-                    user_last_file[user_id] = {"file_id": file_id, "title": title, "saved_at": time.time()}
-                print(f"[DEBUG] Text summary sent successfully")
-            except Exception as e:
-                print(f"[DEBUG] Error: {str(e)}")
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="❌ 摘要失敗，請稍後再試")],
-                    )
-                )
+                    raw_input=src,
+                    normalized_input=normalize_input_light(src),
+                ))
+            except Exception as ex:
+                print(f"[DEBUG] Error: {str(ex)}")
+                try:
+                    reply_or_push(evt, [TextMessage(text="❌ 摘要失敗，請稍後再試")])
+                except Exception:
+                    pass
+
+        show_loading_animation(event)
+        submit_last_file_task(user_id, _summarize_text_async, event, user_id, text)
 
 
 def analyze_image(image_data: bytes) -> str:
@@ -4924,213 +5346,190 @@ def translate_image_text(image_data: bytes, target_language: str) -> str:
 @handler.add(MessageEvent, message=ImageMessageContent)
 def handle_image_message(event):
     """Handle image messages - analyze with OpenAI Vision or translate text in image"""
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        blob_api = MessagingApiBlob(api_client)
+    user_id = event.source.user_id
+    print(f"[DEBUG] Received image message from user: {user_id}")
 
-        user_id = event.source.user_id
-        print(f"[DEBUG] Received image message from user: {user_id}")
+    # Check if OpenAI is configured
+    if not openai_client:
+        reply_text(event, "圖片分析功能未設定，請設定 OPENAI_API_KEY")
+        return
 
-        # Check if OpenAI is configured
-        if not openai_client:
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="圖片分析功能未設定，請設定 OPENAI_API_KEY")],
-                )
-            )
-            return
+    # Download and Vision calls take seconds; answer from the background pool
+    show_loading_animation(event)
+    submit_last_file_task(user_id, process_image_message, event)
 
-        try:
-            # Download image content from LINE
-            image_content = blob_api.get_message_content(event.message.id)
-
-            # Read image data
-            if hasattr(image_content, 'read'):
-                image_data = image_content.read()
-            elif hasattr(image_content, '__iter__') and not isinstance(image_content, bytes):
-                image_data = b''.join(chunk for chunk in image_content)
-            else:
-                image_data = image_content
-
-            # Check if user is in translation mode
-            if user_id in user_states and user_states[user_id].get("mode") == "translate_waiting":
-                target_language = user_states[user_id].get("target_language")
-                print(f"[DEBUG] User in translation mode, translating image text to: {target_language}")
-
-                # Reset timeout
-                user_states[user_id]["entered_at"] = time.time()
-
-                result = translate_image_text(image_data, target_language)
-
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(
-                            text=f"🖼️ 圖片翻譯\n\n{result}\n\n─────────\n💡 繼續傳送圖片或文字可持續翻譯\n輸入「取消」離開翻譯模式",
-                            quick_reply=QuickReply(items=[
-                                QuickReplyItem(action=MessageAction(label="🚪 離開翻譯模式", text="取消")),
-                                QuickReplyItem(action=MessageAction(label="🔄 切換語言", text="切換語言")),
-                            ])
-                        )],
-                    )
-                )
 
-                # Save to Notion
-                save_to_gdrive(
-                    title=f"圖片翻譯：{target_language}",
-                    content_type="翻譯",
-                    category="翻譯",
-                    content=result,
-                    target_language=target_language,
-                    user_id=user_id,
-                    source_type="image",
-                    capture_status=CAPTURE_STATUS_FULL,
-                    extractor="line-image-vision",
-                )
-                return
+def process_image_message(event):
+    """Download an image, then analyze or translate it and save (runs on the background pool)"""
+    user_id = event.source.user_id
+    try:
+        # Download image content from LINE
+        image_content = line_blob_api.get_message_content(event.message.id)
+
+        # Read image data
+        if hasattr(image_content, 'read'):
+            image_data = image_content.read()
+        elif hasattr(image_content, '__iter__') and not isinstance(image_content, bytes):
+            image_data = b''.join(chunk for chunk in image_content)
+        else:
+            image_data = image_content
 
-            # Normal image analysis
-            result = analyze_image(image_data)
-            parsed = parse_summary_response(result)
-            title = parsed["title"] or "圖片分析"
+        # Check if user is in translation mode
+        state = user_states.get(user_id) or {}
+        if state.get("mode") == "translate_waiting":
+            target_language = state.get("target_language")
+            print(f"[DEBUG] User in translation mode, translating image text to: {target_language}")
 
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=f"🖼️ 圖片分析\n\n{result}")],
-                )
-            )
-            print(f"[DEBUG] Image analysis sent successfully")
+            # Reset timeout
+            touch_user_mode(user_id)
 
-            fid = save_to_gdrive(
-                title=title,
-                content_type="圖片分析",
-                category=parsed["category"],
+            result = translate_image_text(image_data, target_language)
+
+            reply_or_push(event, [TextMessage(
+                text=f"🖼️ 圖片翻譯\n\n{result}\n\n─────────\n💡 繼續傳送圖片或文字可持續翻譯\n輸入「取消」離開翻譯模式",
+                quick_reply=TRANSLATION_MODE_QUICK_REPLY
+            )])
+
+            # Save to Google Drive
+            queue_gdrive_save(
+                title=f"圖片翻譯：{target_language}",
+                content_type="翻譯",
+                category="翻譯",
                 content=result,
-                keywords=parsed["keywords"],
+                target_language=target_language,
                 user_id=user_id,
                 source_type="image",
                 capture_status=CAPTURE_STATUS_FULL,
                 extractor="line-image-vision",
-                needs_review=False,
             )
-            if fid:
-                user_last_file[user_id] = {"file_id": fid, "title": title, "saved_at": time.time()}
+            return
 
-        except Exception as e:
-            print(f"[DEBUG] Image processing error: {str(e)}")
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="❌ 圖片分析失敗，請稍後再試")],
-                )
-            )
+        # Normal image analysis
+        result = analyze_image(image_data)
+        parsed = parse_summary_response(result)
+        title = parsed["title"] or "圖片分析"
+
+        reply_or_push(event, [TextMessage(text=f"🖼️ 圖片分析\n\n{result}")])
+        print(f"[DEBUG] Image analysis sent successfully")
+
+        _save_and_remember_last_file(dict(
+            title=title,
+            content_type="圖片分析",
+            category=parsed["category"],
+            content=result,
+            keywords=parsed["keywords"],
+            user_id=user_id,
+            source_type="image",
+            capture_status=CAPTURE_STATUS_FULL,
+            extractor="line-image-vision",
+            needs_review=False,
+        ))
+
+    except Exception as e:
+        print(f"[DEBUG] Image processing error: {str(e)}")
+        try:
+            reply_or_push(event, [TextMessage(text="❌ 圖片分析失敗，請稍後再試")])
+        except Exception:
+            pass
 
 
 @handler.add(MessageEvent, message=AudioMessageContent)
 def handle_audio_message(event):
     """Handle audio messages - transcribe and reply with text"""
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        blob_api = MessagingApiBlob(api_client)
+    # Check if OpenAI is configured
+    if not openai_client:
+        reply_text(event, "語音轉文字功能未設定，請設定 OPENAI_API_KEY")
+        return
+
+    # Answer the webhook right away; Whisper + summary can take longer than
+    # LINE waits before redelivering the event. The loading indicator only
+    # shows in 1:1 chats, so groups and rooms get a text ack instead and the
+    # result is pushed once the reply token is spent.
+    if getattr(event.source, "type", None) in ("group", "room"):
+        reply_text(event, "收到語音，處理中…")
+    else:
+        show_loading_animation(event, seconds=30)
+    background_executor.submit(process_audio_message, event)
 
-        # Check if OpenAI is configured
-        if not openai_client:
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="語音轉文字功能未設定，請設定 OPENAI_API_KEY")],
-                )
-            )
-            return
 
-        try:
-            # Download audio content from LINE
-            audio_content = blob_api.get_message_content(event.message.id)
-
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(suffix=".m4a", delete=False) as tmp_file:
-                # Handle both bytes and iterator response
-                if hasattr(audio_content, 'read'):
-                    tmp_file.write(audio_content.read())
-                elif hasattr(audio_content, '__iter__') and not isinstance(audio_content, bytes):
-                    for chunk in audio_content:
-                        tmp_file.write(chunk)
-                else:
-                    tmp_file.write(audio_content)
-                tmp_file_path = tmp_file.name
-
-            # Transcribe using OpenAI Whisper
-            with open(tmp_file_path, "rb") as audio_file:
-                transcription = openai_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="zh",  # Chinese, change if needed
-                )
+def process_audio_message(event):
+    """Download, transcribe, summarize and save a voice message (runs on the background pool)"""
+    try:
+        # Open the LINE download first so oversize audio is rejected before
+        # downloading it and before Whisper fails on the 25 MB limit
+        audio_response = open_line_message_content(event.message.id)
+        with audio_response:
+            if is_audio_too_large(audio_response.headers.get("Content-Length")):
+                print(f"[DEBUG] Audio too large: {audio_response.headers.get('Content-Length')} bytes")
+                reply_or_push(event, [TextMessage(text=AUDIO_TOO_LARGE_MESSAGE)])
+                return
 
-            # Clean up temp file
-            os.unlink(tmp_file_path)
+            # Buffer in memory, counting bytes as they arrive since Content-Length
+            # may be missing; the OpenAI SDK takes the upload filename, and so
+            # the audio format, from .name
+            audio_file = io.BytesIO()
+            received = 0
+            for chunk in audio_response.stream(LINE_CONTENT_CHUNK_SIZE):
+                received += len(chunk)
+                if is_audio_too_large(received):
+                    print(f"[DEBUG] Audio too large: over {received} bytes")
+                    reply_or_push(event, [TextMessage(text=AUDIO_TOO_LARGE_MESSAGE)])
+                    return
+                audio_file.write(chunk)
+            audio_file.seek(0)
+            audio_file.name = "audio.m4a"
+
+        audio_file = transcode_for_whisper(audio_file)
+
+        # Transcribe using OpenAI Whisper
+        with whisper_semaphore:
+            transcription = openai_client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                language="zh",  # Chinese, change if needed
+            )
 
-            # Check for hallucination
-            result_text = transcription.text if transcription.text else ""
+        # Check for hallucination
+        result_text = transcription.text if transcription.text else ""
 
-            if is_hallucination(result_text):
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="⚠️ 無法辨識語音內容\n\n可能原因：\n• 語音太短或太模糊\n• 背景噪音太大\n• 沒有錄到聲音\n\n請重新錄製語音訊息。")],
-                    )
-                )
-                return
+        if is_hallucination(result_text):
+            reply_or_push(event, [TextMessage(text="⚠️ 無法辨識語音內容\n\n可能原因：\n• 語音太短或太模糊\n• 背景噪音太大\n• 沒有錄到聲音\n\n請重新錄製語音訊息。")])
+            return
 
-            # Auto-analyze transcription (same pipeline as text input)
-            summary = summarize_text(result_text)
+        if is_trivial_transcript(result_text):
+            print(f"[DEBUG] Trivial transcript, skipping summary and save: {result_text}")
+            reply_or_push(event, [TextMessage(text=f"🎙️ 語音內容：{result_text}\n\n內容太短，未保存為筆記。")])
+            return
 
-            reply_text = f"🎙️ 語音筆記\n\n{summary}\n\n─────────\n原始語音：{result_text[:100]}{'...' if len(result_text) > 100 else ''}"
+        # Auto-analyze transcription (same pipeline as text input)
+        summary = summarize_text(result_text)
 
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)],
-                )
-            )
+        voice_reply = f"🎙️ 語音筆記\n\n{summary}\n\n─────────\n原始語音：{result_text[:100]}{'...' if len(result_text) > 100 else ''}"
 
-            user_id = event.source.user_id
-            parsed = parse_summary_response(summary)
-            title = parsed["title"] or f"語音筆記：{result_text[:30]}"
-            fid = save_to_gdrive(
-                title=title,
-                content_type="語音筆記",
-                category=parsed["category"],
-                content=f"{summary}\n\n## 原始語音\n{result_text}",
-                keywords=parsed["keywords"],
-                user_id=user_id,
-                source_type="audio",
-                capture_status=CAPTURE_STATUS_FULL,
-                extractor="line-audio-whisper",
-                needs_review=False,
-                raw_input=result_text,
-                normalized_input=normalize_input_light(result_text),
-            )
-            if fid:
-                user_last_file[user_id] = {"file_id": fid, "title": title, "saved_at": time.time()}
+        reply_or_push(event, [TextMessage(text=voice_reply)])
 
-        except Exception as e:
-            # Clean up temp file if exists
-            if 'tmp_file_path' in locals():
-                try:
-                    os.unlink(tmp_file_path)
-                except:
-                    pass
+        user_id = event.source.user_id
+        parsed = parse_summary_response(summary)
+        title = parsed["title"] or f"語音筆記：{result_text[:30]}"
+        queue_gdrive_save(
+            remember_last_file=True,
+            title=title,
+            content_type="語音筆記",
+            category=parsed["category"],
+            content=f"{summary}\n\n## 原始語音\n{result_text}",
+            keywords=parsed["keywords"],
+            user_id=user_id,
+            source_type="audio",
+            capture_status=CAPTURE_STATUS_FULL,
+            extractor="line-audio-whisper",
+            needs_review=False,
+            raw_input=result_text,
+            normalized_input=normalize_input_light(result_text),
+        )
 
-            print(f"[DEBUG] Audio processing error: {str(e)}")
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text="❌ 語音處理失敗，請稍後再試")],
-                )
-            )
+    except Exception as e:
+        print(f"[DEBUG] Audio processing error: {str(e)}")
+        reply_or_push(event, [TextMessage(text="❌ 語音處理失敗，請稍後再試")])
 
 
 if __name__ == "__main__":
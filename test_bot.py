@@ -7,9 +7,11 @@ import re
 import pytest
 from unittest.mock import patch, MagicMock, PropertyMock
 from types import SimpleNamespace
+from dataclasses import dataclass, field
 import os
 import time
 import json
+import requests
 
 # Set dummy environment variables before importing main
 os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test_token")
@@ -19,6 +21,36 @@ import main
 import desktop_voice_capture as desktop_voice
 
 
+@pytest.fixture(autouse=True, scope="module")
+def _isolate_clients():
+    """整個測試模組不使用真的外部服務；需要時各測試再以 mock patch"""
+    with pytest.MonkeyPatch.context() as mp:
+        for name in ("openai_client", "notion_client", "apify_client"):
+            if getattr(main, name) is not None:
+                mp.setattr(main, name, None)
+        yield
+
+
+@dataclass
+class FakeResponse:
+    """requests.Response 的輕量替身（成功回應，只有程式會讀的欄位）"""
+    text: str = ""
+    json_data: object = None
+    url: str = ""
+    headers: dict = field(default_factory=dict)
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.json_data
+
+
+def chat_completion(content: str) -> SimpleNamespace:
+    """OpenAI chat completion 回應的輕量替身（只有程式會讀的欄位）"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
 # ============================================================
 # 1. URL 提取與偵測測試
 # ============================================================
@@ -172,50 +204,62 @@ class TestDetectSocialPlatform:
         platform, url_type = main.detect_social_platform(url)
         assert platform is None
 
+    def test_combined_pattern_matches_individual_patterns(self):
+        """合併後的單一正則與個別正則判斷一致"""
+        urls = [
+            "https://www.facebook.com/posts",
+            "https://m.facebook.com/some.page/?ref=share",
+            "https://www.threads.net/@user/post/ABC123/",
+            "https://www.threads.net/@user/?hl=zh",
+            "https://www.threads.net/@user/replies",
+            "https://facebook.com/groups/a.b/permalink/1",
+        ]
+        for url in urls:
+            if main.FACEBOOK_POST_PATTERN.match(url):
+                expected = ("facebook", "post")
+            elif main.FACEBOOK_PAGE_PATTERN.match(url):
+                expected = ("facebook", "page")
+            elif main.THREADS_POST_PATTERN.match(url):
+                expected = ("threads", "post")
+            elif main.THREADS_PROFILE_PATTERN.match(url):
+                expected = ("threads", "page")
+            else:
+                expected = (None, "")
+            assert main.detect_social_platform(url) == expected, url
+
 
 class TestGoogleMapsDetection:
     """測試 Google Maps URL 偵測"""
 
     def test_maps_google_com(self):
         url = "https://maps.google.com/some-location"
-        is_maps = any(p in url.lower() for p in [
-            'maps.google.com', 'google.com/maps', 'goo.gl/maps',
-            'maps.app.goo.gl', '/maps/', 'maps.app'
-        ])
+        is_maps = bool(main.GOOGLE_MAPS_PATTERN.search(url))
         assert is_maps is True
 
     def test_google_com_maps(self):
         url = "https://www.google.com/maps/place/some+place"
-        is_maps = any(p in url.lower() for p in [
-            'maps.google.com', 'google.com/maps', 'goo.gl/maps',
-            'maps.app.goo.gl', '/maps/', 'maps.app'
-        ])
+        is_maps = bool(main.GOOGLE_MAPS_PATTERN.search(url))
         assert is_maps is True
 
     def test_goo_gl_maps(self):
         url = "https://goo.gl/maps/abc123"
-        is_maps = any(p in url.lower() for p in [
-            'maps.google.com', 'google.com/maps', 'goo.gl/maps',
-            'maps.app.goo.gl', '/maps/', 'maps.app'
-        ])
+        is_maps = bool(main.GOOGLE_MAPS_PATTERN.search(url))
         assert is_maps is True
 
     def test_maps_app_goo_gl(self):
         url = "https://maps.app.goo.gl/abc123"
-        is_maps = any(p in url.lower() for p in [
-            'maps.google.com', 'google.com/maps', 'goo.gl/maps',
-            'maps.app.goo.gl', '/maps/', 'maps.app'
-        ])
+        is_maps = bool(main.GOOGLE_MAPS_PATTERN.search(url))
         assert is_maps is True
 
     def test_non_maps_url(self):
         url = "https://www.google.com/search?q=test"
-        is_maps = any(p in url.lower() for p in [
-            'maps.google.com', 'google.com/maps', 'goo.gl/maps',
-            'maps.app.goo.gl', '/maps/', 'maps.app'
-        ])
+        is_maps = bool(main.GOOGLE_MAPS_PATTERN.search(url))
         assert is_maps is False
 
+    def test_case_insensitive(self):
+        assert main.GOOGLE_MAPS_PATTERN.search("https://Maps.App.goo.gl/abc123")
+        assert main.source_type_from_url("https://WWW.GOOGLE.COM/MAPS/place/x") == "google_maps"
+
 
 # ============================================================
 # 2. 翻譯請求解析測試
@@ -274,6 +318,10 @@ class TestParseTranslationRequest:
         result = main.parse_translation_request("你好世界")
         assert result is None
 
+    def test_translation_with_full_please_prefix(self):
+        result = main.parse_translation_request("  請幫我翻譯成日文：早安")
+        assert result == ("Japanese", "早安")
+
 
 class TestLanguageMap:
     """測試語言對照表"""
@@ -610,16 +658,12 @@ class TestCaptureQuality:
         assert main.normalize_env_value("   ") is None
         assert main.normalize_env_value(None) is None
 
-    def test_get_gdrive_auth_mode_prefers_oauth_token(self):
-        original_mode = main.GDRIVE_AUTH_MODE
-        original_token = main.GDRIVE_OAUTH_TOKEN_JSON
-        main.GDRIVE_AUTH_MODE = "auto"
-        main.GDRIVE_OAUTH_TOKEN_JSON = '{"refresh_token":"token"}'
+    def test_get_gdrive_auth_mode_prefers_oauth_token(self, monkeypatch):
+        monkeypatch.setattr(main, "GDRIVE_AUTH_MODE", "auto")
+        monkeypatch.setattr(main, "GDRIVE_OAUTH_TOKEN_JSON", '{"refresh_token":"token"}')
         assert main.get_gdrive_auth_mode() == "oauth"
-        main.GDRIVE_OAUTH_TOKEN_JSON = None
+        monkeypatch.setattr(main, "GDRIVE_OAUTH_TOKEN_JSON", None)
         assert main.get_gdrive_auth_mode() == "service_account"
-        main.GDRIVE_AUTH_MODE = original_mode
-        main.GDRIVE_OAUTH_TOKEN_JSON = original_token
 
     def test_build_gdrive_diagnostic_message_success(self):
         result = {
@@ -711,6 +755,12 @@ class TestIsHallucination:
         assert main.is_hallucination("字幕由 Amara 提供") is True
         assert main.is_hallucination("like and subscribe") is True
 
+    def test_pattern_matching_is_literal(self):
+        """測試模式比對不分大小寫且不受正規表示式特殊字元影響"""
+        assert main.is_hallucination("Thanks For Watching everyone") is True
+        assert main.is_hallucination("visit Amara.org today") is True
+        assert main.is_hallucination("visit amaraXorg today") is False
+
     def test_repeated_words(self):
         assert main.is_hallucination("嗯 嗯 嗯") is True
         assert main.is_hallucination("啊 啊 啊") is True
@@ -721,10 +771,124 @@ class TestIsHallucination:
         assert main.is_hallucination("Hello world this is a test") is False
 
 
+class TestIsTrivialTranscript:
+    """測試過短語音逐字稿不存檔"""
+
+    def test_punctuation_only_is_trivial(self):
+        assert main.is_trivial_transcript("嗯，。。。") is True
+        assert main.is_trivial_transcript("") is True
+
+    def test_meaningful_text_not_trivial(self):
+        assert main.is_trivial_transcript("明天開會") is False
+        assert main.is_trivial_transcript("今天天氣真好，我想出去走走") is False
+
+
+class TestAudioSizeLimit:
+    """測試語音檔大小上限（Whisper 25MB）"""
+
+    def test_small_audio_allowed(self):
+        assert main.is_audio_too_large("1048576") is False
+
+    def test_oversize_audio_rejected(self):
+        assert main.is_audio_too_large(str(main.WHISPER_MAX_AUDIO_BYTES)) is True
+        assert main.is_audio_too_large(30 * 1024 * 1024) is True
+
+    def test_missing_content_length_allowed(self):
+        assert main.is_audio_too_large(None) is False
+        assert main.is_audio_too_large("") is False
+
+    @patch("main.transcode_for_whisper")
+    @patch("main.reply_or_push")
+    @patch("main.open_line_message_content")
+    def test_stream_without_content_length_stops_at_limit(self, mock_open, mock_reply, mock_transcode):
+        """沒有 Content-Length 時，下載中累計超過上限即中止"""
+        response = MagicMock(headers={})
+        response.__enter__.return_value = response
+        response.stream.return_value = iter([b"x" * 600, b"x" * 600, b"x" * 600])
+        mock_open.return_value = response
+        event = SimpleNamespace(message=SimpleNamespace(id="m1"), source=SimpleNamespace(type="user", user_id="user1"))
+
+        with patch("main.WHISPER_MAX_AUDIO_BYTES", 1000):
+            main.process_audio_message(event)
+
+        assert mock_reply.call_args.args[1][0].text == main.AUDIO_TOO_LARGE_MESSAGE
+        mock_transcode.assert_not_called()
+
+    @patch("main.line_blob_api")
+    def test_content_is_opened_through_sdk_unread(self, mock_blob):
+        """語音內容經 SDK 下載，且不預先讀取本體"""
+        raw = MagicMock()
+        mock_blob.get_message_content_with_http_info.return_value = SimpleNamespace(raw_data=raw)
+        assert main.open_line_message_content("m1") is raw
+        args, kwargs = mock_blob.get_message_content_with_http_info.call_args
+        assert args == ("m1",)
+        assert kwargs["_preload_content"] is False
+
+
+class TestTranscodeForWhisper:
+    """測試語音上傳前轉檔（ffmpeg 可選）"""
+
+    def _audio(self, size):
+        audio = main.io.BytesIO(b"\0" * size)
+        audio.name = "audio.m4a"
+        return audio
+
+    @patch("main.FFMPEG_PATH", None)
+    def test_without_ffmpeg_returns_original(self):
+        audio = self._audio(100_000)
+        assert main.transcode_for_whisper(audio) is audio
+
+    @patch("main.subprocess.run")
+    @patch("main.FFMPEG_PATH", "/usr/bin/ffmpeg")
+    def test_small_clip_not_transcoded(self, mock_run):
+        audio = self._audio(1_000)
+        assert main.transcode_for_whisper(audio) is audio
+        mock_run.assert_not_called()
+
+    @patch("main.subprocess.run")
+    @patch("main.FFMPEG_PATH", "/usr/bin/ffmpeg")
+    def test_transcoded_output_used(self, mock_run):
+        mock_run.return_value = SimpleNamespace(stdout=b"o" * 20_000)
+        result = main.transcode_for_whisper(self._audio(100_000))
+        assert result.name == "audio.ogg"
+        assert len(result.getvalue()) == 20_000
+
+    @patch("main.subprocess.run")
+    @patch("main.FFMPEG_PATH", "/usr/bin/ffmpeg")
+    def test_ffmpeg_failure_falls_back(self, mock_run):
+        mock_run.side_effect = main.subprocess.CalledProcessError(1, "ffmpeg")
+        audio = self._audio(100_000)
+        assert main.transcode_for_whisper(audio) is audio
+
+
 # ============================================================
 # 6. 多篇爬取指令解析測試
 # ============================================================
 
+class TestCommandPattern:
+    """測試知識庫指令 regex（單次比對判斷指令類型）"""
+
+    def _command(self, text):
+        match = main.COMMAND_PATTERN.match(text)
+        return match.lastgroup if match else None
+
+    def test_command_types(self):
+        assert self._command("查 投資") == "query"
+        assert self._command("查行程") == "schedule"
+        assert self._command("加行程：明天下午三點開會") == "add_event"
+        assert self._command("加聯絡人: Jason 同事") == "add_contact"
+        assert self._command("請問 什麼是 RAG") == "ask"
+
+    def test_command_arguments(self):
+        assert main.COMMAND_PATTERN.match("搜尋 AI 工具").group("keyword") == "AI 工具"
+        assert main.COMMAND_PATTERN.match("記行程:週五聚餐").group("event_text") == "週五聚餐"
+
+    def test_non_commands(self):
+        assert self._command("查行程表") is None
+        assert self._command("問") is None
+        assert self._command("今天天氣很好") is None
+
+
 class TestScrapeMultiPattern:
     """測試多篇爬取指令 regex"""
 
@@ -837,6 +1001,13 @@ class TestQuickReplyLanguages:
         assert "日文" in labels
         assert "韓文" in labels
 
+    def test_language_quick_reply_menu(self):
+        """預先建立的選單應包含所有語言與取消選項"""
+        items = main.LANGUAGE_QUICK_REPLY.items
+        assert [item.action.text for item in items[:-1]] == [label for label, _ in main.QUICK_REPLY_LANGUAGES]
+        assert items[-1].action.text == "取消"
+        assert len(items) <= 13  # LINE Quick Reply 上限
+
 
 # ============================================================
 # 9. 使用者狀態管理測試
@@ -899,6 +1070,41 @@ class TestUserStates:
         entered_at = main.user_states["user1"]["entered_at"]
         assert current_time - entered_at < main.TRANSLATION_MODE_TIMEOUT
 
+    def test_expire_translation_mode(self):
+        """測試到期時移除翻譯狀態"""
+        main.enter_user_mode("user1", "translate_waiting", target_language="English")
+        entered_at = main.user_states["user1"]["entered_at"]
+        assert main.expire_user_state("user1", entered_at + main.TRANSLATION_MODE_TIMEOUT) == "translate_waiting"
+        assert "user1" not in main.user_states
+
+    def test_stale_timeout_entry_skipped(self):
+        """測試使用者重新活動後，舊的逾時項目不會退出翻譯模式"""
+        main.enter_user_mode("user1", "translate_select_language")
+        deadline = main.user_states["user1"]["entered_at"] + main.TRANSLATION_MODE_TIMEOUT
+        main.user_states["user1"]["entered_at"] += 60
+        assert not main.expire_user_state("user1", deadline)
+        assert "user1" in main.user_states
+
+    def test_pop_user_state_missing(self):
+        """測試狀態已被逾時執行緒移除時不會拋出 KeyError"""
+        main.set_user_state("user1", {"mode": "scrape_waiting_count"})
+        assert main.pop_user_state("user1") == {"mode": "scrape_waiting_count"}
+        assert main.pop_user_state("user1") is None
+        main.touch_user_mode("user1")
+        assert "user1" not in main.user_states
+
+    def test_scrape_waiting_state_expires(self):
+        """測試等待爬取篇數的狀態也會逾時清除，避免狀態無限累積"""
+        main.enter_user_mode("user1", "scrape_waiting_count", url="https://facebook.com/page", platform="facebook")
+        assert main.user_states["user1"]["url"] == "https://facebook.com/page"
+        assert main.expire_user_state("user1", time.time() + main.TRANSLATION_MODE_TIMEOUT) == "scrape_waiting_count"
+        assert "user1" not in main.user_states
+
+    def test_expire_ignores_unknown_modes(self):
+        """測試未知模式不受逾時影響"""
+        main.user_states["user1"] = {"mode": "something_else", "entered_at": 0}
+        assert main.expire_user_state("user1", time.time()) is None
+
 
 # ============================================================
 # 10. Flask 路由測試
@@ -995,27 +1201,23 @@ class TestLineBotUsageCards:
 class TestResolveShortUrl:
     """測試短網址解析"""
 
-    @patch("main.requests.head")
+    @patch("main.http_session.head")
     def test_resolve_redirect(self, mock_head):
         """短網址應被解析為完整 URL"""
-        mock_response = MagicMock()
-        mock_response.url = "https://www.google.com/maps/place/Tokyo+Tower"
-        mock_head.return_value = mock_response
+        mock_head.return_value = FakeResponse(url="https://www.google.com/maps/place/Tokyo+Tower")
 
         result = main.resolve_short_url("https://maps.app.goo.gl/abc123")
         assert result == "https://www.google.com/maps/place/Tokyo+Tower"
 
-    @patch("main.requests.head")
+    @patch("main.http_session.head")
     def test_no_redirect(self, mock_head):
         """沒有重定向時回傳原始 URL"""
-        mock_response = MagicMock()
-        mock_response.url = "https://maps.app.goo.gl/abc123"
-        mock_head.return_value = mock_response
+        mock_head.return_value = FakeResponse(url="https://maps.app.goo.gl/abc123")
 
         result = main.resolve_short_url("https://maps.app.goo.gl/abc123")
         assert result == "https://maps.app.goo.gl/abc123"
 
-    @patch("main.requests.head")
+    @patch("main.http_session.head")
     def test_resolve_failure(self, mock_head):
         """解析失敗時回傳原始 URL"""
         mock_head.side_effect = Exception("Timeout")
@@ -1027,13 +1229,37 @@ class TestResolveShortUrl:
 # 11. 網頁抓取功能測試（使用 mock）
 # ============================================================
 
+class TestHttpSessionCookies:
+    """測試共用 HTTP session 不保存 cookie"""
+
+    def test_response_cookies_not_persisted(self):
+        import email.message
+        import urllib.request
+
+        headers = email.message.Message()
+        headers["Set-Cookie"] = "sid=abc; Path=/"
+        response = SimpleNamespace(info=lambda: headers)
+        request = urllib.request.Request("https://www.ptt.cc/bbs/Gossiping/index.html")
+
+        main.http_session.cookies.extract_cookies(response, request)
+        assert len(main.http_session.cookies) == 0
+
+    def test_per_request_cookies_still_sent(self):
+        prepared = main.http_session.prepare_request(
+            requests.Request("GET", "https://www.ptt.cc/bbs/Gossiping/index.html", cookies={"over18": "1"})
+        )
+        assert prepared.headers["Cookie"] == "over18=1"
+
+
 class TestFetchWebpageContent:
     """測試網頁內容抓取"""
 
-    @patch("main.requests.get")
+    def setup_method(self):
+        main._webpage_cache.clear()
+
+    @patch("main.http_session.get")
     def test_fetch_simple_page(self, mock_get):
-        mock_response = MagicMock()
-        mock_response.text = """
+        mock_get.return_value = FakeResponse(text="""
         <html>
             <head><title>Test Title</title>
             <meta name="description" content="Test description">
@@ -1044,25 +1270,38 @@ class TestFetchWebpageContent:
                 </article>
             </body>
         </html>
-        """
-        mock_response.raise_for_status = MagicMock()
-        mock_get.return_value = mock_response
+        """)
 
         result = main.fetch_webpage_content("https://example.com")
         assert "Test Title" in result
         assert "Test description" in result
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
     def test_fetch_page_error(self, mock_get):
         mock_get.side_effect = Exception("Connection error")
         result = main.fetch_webpage_content("https://invalid.com")
         assert "無法抓取網頁內容" in result
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
+    def test_successful_fetch_is_cached(self, mock_get):
+        mock_get.return_value = FakeResponse(text="cached page body")
+        assert main.fetch_webpage_content("https://example.com/a?utm_source=line") == "cached page body"
+        assert main.fetch_webpage_content("https://example.com/a") == "cached page body"
+        assert mock_get.call_count == 1
+
+    @patch("main.http_session.get")
+    def test_failed_fetch_not_cached(self, mock_get):
+        mock_get.side_effect = Exception("Connection error")
+        main.fetch_webpage_content("https://invalid.com")
+        main.fetch_webpage_content("https://invalid.com")
+        assert mock_get.call_count == 4
+
+    @patch("main.http_session.get")
     def test_fetch_page_strips_scripts(self, mock_get):
         # 第一次 call (Jina AI) 失敗，第二次走 fallback 才會用 BeautifulSoup 過濾 <script>
         fallback_response = MagicMock()
-        fallback_response.text = """
+        fallback_response.headers = {}
+        fallback_response.iter_content.return_value = ["""
         <html>
             <head><title>Page</title></head>
             <body>
@@ -1070,7 +1309,7 @@ class TestFetchWebpageContent:
                 <p>This is the actual content that should remain after cleaning up all the scripts.</p>
             </body>
         </html>
-        """
+        """.encode("utf-8")]
         fallback_response.raise_for_status = MagicMock()
         mock_get.side_effect = [Exception("Jina down"), fallback_response]
 
@@ -1078,6 +1317,72 @@ class TestFetchWebpageContent:
         assert "alert" not in result
         assert "actual content" in result
 
+    def test_html_to_text_parsers_agree(self):
+        """selectolax 與 BeautifulSoup 兩種解析路徑結果一致"""
+        html = """
+        <html><head><title>Page</title><style>p {}</style></head>
+        <body><nav>Menu item one two three four</nav>
+        <p>First paragraph with enough text to keep.</p><div>Second block of content here.</div>
+        <footer>Footer links and copyright notice</footer></body></html>
+        """
+        with patch("main.LexborHTMLParser", None):
+            expected = main.html_to_text(html)
+        assert "Menu" not in expected and "Footer" not in expected
+        if main.LexborHTMLParser is None:
+            pytest.skip("selectolax not installed")
+        assert main.html_to_text(html) == expected
+
+    def test_line_filter_matches_strip_and_length(self):
+        """行過濾結果應與逐行 strip 後長度 > 20 的結果一致"""
+        content = "短行\n   exactly twenty chars   \n  exactly twenty-one c  \n\n\u3000這是一段足夠長的中文內容，應該被保留下來才對\u3000\nfoo\tbar baz qux quux corge\r"
+        expected = [line.strip() for line in content.split("\n") if len(line.strip()) > 20]
+        assert main.WEBPAGE_LINE_PATTERN.findall(content) == expected
+
+    def test_read_capped_html_stops_at_limit(self):
+        """只讀取前 max_bytes，並依 meta charset 解碼"""
+        response = MagicMock()
+        response.headers = {"Content-Type": "text/html"}
+        head = '<meta charset="big5"><title>測試</title>'.encode("big5")
+        response.iter_content.return_value = iter([head, b"x" * 100, b"never read"])
+
+        result = main.read_capped_html(response, max_bytes=len(head) + 50)
+        assert result.startswith('<meta charset="big5"><title>測試</title>')
+        assert result.endswith("x" * 50)
+        assert "never" not in result
+
+
+class TestUrlSummaryCache:
+    """測試 URL 摘要快取"""
+
+    def setup_method(self):
+        main._url_summary_cache.clear()
+
+    def test_canonicalize_url(self):
+        assert main.canonicalize_url("HTTPS://Example.com/a?b=2&a=1#frag") == "https://example.com/a?a=1&b=2"
+
+    def test_canonicalize_url_drops_tracking_params(self):
+        url = "https://example.com/a?utm_source=line&id=3&fbclid=abc"
+        assert main.canonicalize_url(url) == "https://example.com/a?id=3"
+
+    def test_cache_hit_ignores_fragment_and_query_order(self):
+        main.cache_url_summary("https://example.com/a?b=2&a=1", ("summary", "jina", {"status": "full"}))
+        assert main.get_cached_url_summary("https://example.com/a?a=1&b=2#top")[0] == "summary"
+
+    def test_expired_entry_is_dropped(self):
+        with patch("main.URL_SUMMARY_CACHE_TTL", -1):
+            main.cache_url_summary("https://example.com", ("summary", "jina", {}))
+        assert main.get_cached_url_summary("https://example.com") is None
+        assert len(main._url_summary_cache) == 0
+
+    def test_lru_eviction(self):
+        with patch("main.URL_SUMMARY_CACHE_MAXSIZE", 2):
+            main.cache_url_summary("https://example.com/1", ("1", "jina", {}))
+            main.cache_url_summary("https://example.com/2", ("2", "jina", {}))
+            main.get_cached_url_summary("https://example.com/1")
+            main.cache_url_summary("https://example.com/3", ("3", "jina", {}))
+        assert main.get_cached_url_summary("https://example.com/1") is not None
+        assert main.get_cached_url_summary("https://example.com/2") is None
+
 
 # ============================================================
 # 12. Notion 儲存功能測試（使用 mock）
@@ -1086,10 +1391,9 @@ class TestFetchWebpageContent:
 class TestSaveToGDrive:
     """測試 Google Drive 儲存功能（取代舊的 Notion 儲存）"""
 
-    def test_save_without_vault_configured(self):
+    def test_save_without_vault_configured(self, monkeypatch):
         """GDRIVE_VAULT_FOLDER_ID 未設定時應回傳 False"""
-        original = main.GDRIVE_VAULT_FOLDER_ID
-        main.GDRIVE_VAULT_FOLDER_ID = None
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", None)
 
         result = main.save_to_gdrive(
             title="Test",
@@ -1099,12 +1403,9 @@ class TestSaveToGDrive:
         )
         assert result is False
 
-        main.GDRIVE_VAULT_FOLDER_ID = original
-
-    def test_save_social_without_vault_configured(self):
+    def test_save_social_without_vault_configured(self, monkeypatch):
         """GDRIVE_VAULT_FOLDER_ID 未設定時社群儲存應回傳 False"""
-        original = main.GDRIVE_VAULT_FOLDER_ID
-        main.GDRIVE_VAULT_FOLDER_ID = None
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", None)
 
         result = main.save_social_to_gdrive(
             platform="Facebook",
@@ -1119,7 +1420,26 @@ class TestSaveToGDrive:
         )
         assert result is False
 
-        main.GDRIVE_VAULT_FOLDER_ID = original
+    @patch.dict(main.gdrive_folder_cache, clear=True)
+    def test_folder_lookup_cached(self):
+        """同一資料夾只查詢一次 Drive"""
+        service = MagicMock()
+        service.files.return_value.list.return_value.execute.return_value = {"files": [{"id": "folder1"}]}
+
+        assert main.get_or_create_folder(service, "Sources", "root") == "folder1"
+        assert main.get_or_create_folder(service, "Sources", "root") == "folder1"
+        assert service.files.return_value.list.call_count == 1
+
+    @patch.dict(main.gdrive_folder_cache, {("root", "Sources"): "stale"}, clear=True)
+    @patch("main.GDRIVE_VAULT_FOLDER_ID", "root")
+    def test_failed_save_clears_folder_cache(self):
+        service = MagicMock()
+        service.files.return_value.create.return_value.execute.side_effect = Exception("File not found")
+
+        result = main.save_to_gdrive(title="T", content_type="筆記", category="其他", content="c", service=service)
+
+        assert result is None
+        assert main.gdrive_folder_cache == {}
 
     @patch("main.save_to_gdrive")
     def test_save_social_passes_capture_metadata(self, mock_save):
@@ -1212,69 +1532,98 @@ class TestSaveToGDrive:
         assert kwargs["extractor"] == "facebook-apify"
         assert kwargs["needs_review"] is False
 
+    @patch("main.save_normalized_social_post")
+    def test_save_social_posts_counts_saved_and_survives_errors(self, mock_save):
+        def fake_save(**kwargs):
+            if kwargs["source_url"].endswith("/2"):
+                raise Exception("Drive error")
+            return ("file_" + kwargs["source_url"][-1], {})
+        mock_save.side_effect = fake_save
+        posts = [{"url": f"https://threads.net/p/{i}", "text": "x"} for i in range(4)]
+
+        saved = main.save_social_posts(posts, "threads", "https://threads.net/@u", raw_input="爬 4 篇", user_id="user1")
+
+        assert saved == 3
+        assert mock_save.call_count == 4
+
+    def test_queued_saves_are_drained_as_one_batch(self):
+        """佇列中的儲存請求應一次批次取出"""
+        with patch("main.gdrive_save_queue", main.queue.Queue()), \
+                patch("main.GDRIVE_SAVE_BATCH_WINDOW", 0.05):
+            main.queue_gdrive_save(title="A", user_id="user1")
+            main.queue_gdrive_save(title="B", user_id="user2")
+            batch = main._drain_gdrive_save_batch()
+
+        assert batch == [
+            {"title": "A", "user_id": "user1"},
+            {"title": "B", "user_id": "user2"},
+        ]
+
+    @patch("main.save_to_gdrive", return_value="file-1")
+    def test_remembered_save_sets_last_file_before_supplement(self, _mock_save):
+        """需記住的筆記不進批次佇列，補充想法會等它存好再取用"""
+        with patch("main.gdrive_save_queue", main.queue.Queue()) as save_queue, \
+                patch.dict(main.user_last_file, clear=True), \
+                patch.dict(main.user_pending_last_file, clear=True):
+            main.queue_gdrive_save(remember_last_file=True, title="B", user_id="user1")
+            main.wait_for_pending_last_file("user1")
+
+            assert save_queue.empty()
+            assert main.user_last_file["user1"]["file_id"] == "file-1"
+
+    @patch("main.background_executor")
+    def test_finished_last_file_task_is_pruned(self, mock_executor):
+        """背景任務完成後移除待完成紀錄，但不移除較新的任務"""
+        older, newer = main.Future(), main.Future()
+        mock_executor.submit.side_effect = [older, newer]
+        with patch.dict(main.user_pending_last_file, clear=True):
+            main.submit_last_file_task("user1", print)
+            main.submit_last_file_task("user1", print)
+            older.set_result(None)
+            assert main.user_pending_last_file["user1"] is newer
+            newer.set_result(None)
+            assert "user1" not in main.user_pending_last_file
+
+    @patch("main.save_to_gdrive", return_value="file-1")
+    def test_worker_flushes_queued_saves_before_stopping(self, mock_save):
+        """關閉時先寫完佇列中的筆記再結束背景執行緒"""
+        with patch("main.gdrive_save_queue", main.queue.Queue()), \
+                patch("main.GDRIVE_VAULT_FOLDER_ID", ""), \
+                patch("main.GDRIVE_SAVE_BATCH_WINDOW", 0.05):
+            main.queue_gdrive_save(title="A", user_id="user1")
+            main.gdrive_save_queue.put(main.GDRIVE_SAVE_STOP)
+            main.gdrive_save_worker()
+
+        mock_save.assert_called_once_with(service=None, title="A", user_id="user1")
+
 
 # ============================================================
 # 13. OpenAI 功能測試（使用 mock）
 # ============================================================
 
-class TestOpenAIFunctions:
-    """測試 OpenAI 相關功能"""
-
-    def test_translate_without_openai(self):
-        """OpenAI 未設定時翻譯應回傳錯誤訊息"""
-        original_client = main.openai_client
-        main.openai_client = None
-
-        result = main.translate_text("你好", "English")
-        assert "翻譯功能未設定" in result
-
-        main.openai_client = original_client
-
-    def test_summarize_webpage_without_openai(self):
-        """OpenAI 未設定時摘要應回傳錯誤訊息"""
-        original_client = main.openai_client
-        main.openai_client = None
-
-        result = main.summarize_webpage("test content")
-        assert "網頁摘要功能未設定" in result
-
-        main.openai_client = original_client
-
-    def test_summarize_text_without_openai(self):
-        original_client = main.openai_client
-        main.openai_client = None
-
-        result = main.summarize_text("test text")
-        assert "文字摘要功能未設定" in result
-
-        main.openai_client = original_client
-
-    def test_summarize_google_maps_without_openai(self):
-        original_client = main.openai_client
-        main.openai_client = None
-
-        result = main.summarize_google_maps("content", "https://maps.google.com")
-        assert "地圖分析功能未設定" in result
-
-        main.openai_client = original_client
-
-    def test_summarize_social_without_openai(self):
-        original_client = main.openai_client
-        main.openai_client = None
+class TestOpenAIFunctionsWithoutClient:
+    """測試 OpenAI 未設定時的錯誤訊息"""
+
+    @pytest.mark.parametrize("func, args, message", [
+        (main.translate_text, ("你好", "English"), "翻譯功能未設定"),
+        (main.summarize_webpage, ("test content",), "網頁摘要功能未設定"),
+        (main.summarize_text, ("test text",), "文字摘要功能未設定"),
+        (main.summarize_google_maps, ("content", "https://maps.google.com"), "地圖分析功能未設定"),
+        (main.summarize_social_post, ({"username": "test", "text": "hello"}, "facebook"), "社群分析功能未設定"),
+    ])
+    def test_without_openai(self, func, args, message):
+        """OpenAI 未設定時應回傳錯誤訊息"""
+        assert message in func(*args)
 
-        result = main.summarize_social_post({"username": "test", "text": "hello"}, "facebook")
-        assert "社群分析功能未設定" in result
 
-        main.openai_client = original_client
+class TestOpenAIFunctions:
+    """測試 OpenAI 相關功能"""
 
     @patch("main.openai_client")
     def test_translate_text_success(self, mock_client):
         """測試翻譯功能正常回傳"""
         main.openai_client = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = "Hello World"
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create.return_value = chat_completion("Hello World")
 
         result = main.translate_text("你好世界", "English")
         assert result == "Hello World"
@@ -1288,6 +1637,19 @@ class TestOpenAIFunctions:
         result = main.translate_text("你好", "English")
         assert "翻譯失敗" in result
 
+    @patch("main.openai_client")
+    def test_summarize_text_truncates_long_input(self, mock_client):
+        """過長的輸入在送出前應被截斷"""
+        main.openai_client = mock_client
+        mock_client.chat.completions.create.return_value = chat_completion("summary")
+
+        with patch("main.SUMMARY_INPUT_MAX_CHARS", 100):
+            main.summarize_text("A" * 99 + "B" + "C" * 1000)
+        prompt = mock_client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        assert "A" * 99 + "B" in prompt
+        assert "C" not in prompt
+        assert "已截斷" in prompt
+
 
 # ============================================================
 # 14. Apify 爬蟲功能測試（使用 mock）
@@ -1296,34 +1658,51 @@ class TestOpenAIFunctions:
 class TestApifyScraping:
     """測試 Apify 爬蟲功能"""
 
-    def test_scrape_facebook_without_apify(self):
-        """Apify 未設定時應回傳空列表"""
-        original_client = main.apify_client
-        main.apify_client = None
-
-        result = main.scrape_facebook_post("https://facebook.com/post/123")
-        assert result == []
-
-        main.apify_client = original_client
-
-    def test_scrape_threads_without_apify(self):
-        original_client = main.apify_client
-        main.apify_client = None
-
-        result = main.scrape_threads_post("https://threads.net/@user/post/123")
-        assert result == []
-
-        main.apify_client = original_client
-
-    def test_scrape_google_maps_without_apify(self):
-        """Apify 未設定時應回傳 None"""
-        original_client = main.apify_client
-        main.apify_client = None
+    @pytest.mark.parametrize("func, url, expected", [
+        (main.scrape_facebook_post, "https://facebook.com/post/123", []),
+        (main.scrape_threads_post, "https://threads.net/@user/post/123", []),
+        (main.scrape_google_maps, "https://maps.google.com/place/test", None),
+    ])
+    def test_scrape_without_apify(self, func, url, expected):
+        """Apify 未設定時貼文爬取回傳空列表，地點爬取回傳 None"""
+        assert func(url) == expected
+
+
+class TestScrapeSocialPostsAsync:
+    """測試多篇社群貼文爬取（背景執行）"""
+
+    @patch("main.scrape_threads_post")
+    @patch("main.background_executor")
+    @patch("main.apify_client", new=MagicMock())
+    @patch("main.line_messaging_api")
+    def test_multi_post_command_runs_in_background(self, mock_api, mock_executor, mock_scrape):
+        event = SimpleNamespace(
+            reply_token="token",
+            message=SimpleNamespace(text="爬 5 篇 https://www.threads.net/@user"),
+            source=SimpleNamespace(type="user", user_id="user1"),
+        )
+        main.handle_text_message(event)
+        mock_api.reply_message_with_http_info.assert_called_once()
+        mock_scrape.assert_not_called()
+        mock_executor.submit.assert_called_once_with(
+            main.scrape_social_posts_async, "user1", "https://www.threads.net/@user", "threads", 5,
+            "爬 5 篇 https://www.threads.net/@user",
+        )
 
-        result = main.scrape_google_maps("https://maps.google.com/place/test")
-        assert result is None
+    @patch("main.save_normalized_social_post", return_value=("file-1", {}))
+    @patch("main.scrape_threads_post", return_value=[{"text": "a"}, {"text": "b"}])
+    @patch("main.line_messaging_api")
+    def test_pushes_result(self, mock_api, _mock_scrape, _mock_save):
+        main.scrape_social_posts_async("user1", "https://www.threads.net/@user", "threads", 2, "raw")
+        request = mock_api.push_message.call_args.args[0]
+        assert request.to == "user1"
+        assert "成功存入 Obsidian 2 篇" in request.messages[0].text
 
-        main.apify_client = original_client
+    @patch("main.scrape_threads_post", side_effect=Exception("Apify down"))
+    @patch("main.line_messaging_api")
+    def test_reports_failure(self, mock_api, _mock_scrape):
+        main.scrape_social_posts_async("user1", "https://www.threads.net/@user", "threads", 2, "raw")
+        assert "失敗" in mock_api.push_message.call_args.args[0].messages[0].text
 
 
 # ============================================================
@@ -1372,27 +1751,22 @@ class TestYouTubeExtractor:
         result = main.choose_youtube_caption_track(player_response)
         assert result["languageCode"] == "zh-Hant"
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
     def test_fetch_youtube_transcript_json3(self, mock_get):
-        response = MagicMock()
-        response.raise_for_status = MagicMock()
-        response.text = json.dumps({"events": [{"segs": [{"utf8": "第一句"}, {"utf8": "第二句"}]}]})
-        response.json.return_value = {"events": [{"segs": [{"utf8": "第一句"}, {"utf8": "第二句"}]}]}
-        mock_get.return_value = response
+        payload = {"events": [{"segs": [{"utf8": "第一句"}, {"utf8": "第二句"}]}]}
+        mock_get.return_value = FakeResponse(text=json.dumps(payload), json_data=payload)
 
         result = main.fetch_youtube_transcript("https://youtube.com/api/timedtext?v=abc")
         assert "第一句第二句" in result
         assert "fmt=json3" in mock_get.call_args.args[0]
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
     def test_fetch_youtube_content_with_transcript(self, mock_get):
-        oembed_response = MagicMock()
-        oembed_response.raise_for_status = MagicMock()
-        oembed_response.json.return_value = {
+        oembed_response = FakeResponse(json_data={
             "title": "OEmbed Title",
             "author_name": "Channel",
             "author_url": "https://youtube.com/@channel",
-        }
+        })
         player_payload = {
             "videoDetails": {
                 "videoId": "abc",
@@ -1416,14 +1790,12 @@ class TestYouTubeExtractor:
                 }
             },
         }
-        watch_response = MagicMock()
-        watch_response.raise_for_status = MagicMock()
-        watch_response.text = f"<script>var ytInitialPlayerResponse = {json.dumps(player_payload)};</script>"
-        watch_response.url = "https://www.youtube.com/watch?v=abc"
-        transcript_response = MagicMock()
-        transcript_response.raise_for_status = MagicMock()
-        transcript_response.text = json.dumps({"events": [{"segs": [{"utf8": "逐字稿內容"}]}]})
-        transcript_response.json.return_value = {"events": [{"segs": [{"utf8": "逐字稿內容"}]}]}
+        watch_response = FakeResponse(
+            text=f"<script>var ytInitialPlayerResponse = {json.dumps(player_payload)};</script>",
+            url="https://www.youtube.com/watch?v=abc",
+        )
+        transcript_payload = {"events": [{"segs": [{"utf8": "逐字稿內容"}]}]}
+        transcript_response = FakeResponse(text=json.dumps(transcript_payload), json_data=transcript_payload)
         mock_get.side_effect = [oembed_response, watch_response, transcript_response]
 
         content, extractor = main.fetch_youtube_content("https://www.youtube.com/watch?v=abc")
@@ -1436,19 +1808,17 @@ class TestYouTubeExtractor:
         assert "觀看次數：12345" in content
         assert "分類：Education" in content
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
     def test_fetch_youtube_content_metadata_only(self, mock_get):
-        oembed_response = MagicMock()
-        oembed_response.raise_for_status = MagicMock()
-        oembed_response.json.return_value = {
+        oembed_response = FakeResponse(json_data={
             "title": "Metadata Only",
             "author_name": "Channel",
             "author_url": "https://youtube.com/@channel",
-        }
-        watch_response = MagicMock()
-        watch_response.raise_for_status = MagicMock()
-        watch_response.text = "<script>var ytInitialPlayerResponse = {\"videoDetails\": {}};</script>"
-        watch_response.url = "https://www.youtube.com/watch?v=abc"
+        })
+        watch_response = FakeResponse(
+            text="<script>var ytInitialPlayerResponse = {\"videoDetails\": {}};</script>",
+            url="https://www.youtube.com/watch?v=abc",
+        )
         mock_get.side_effect = [oembed_response, watch_response]
 
         content, extractor = main.fetch_youtube_content("https://www.youtube.com/watch?v=abc")
@@ -1535,12 +1905,9 @@ class TestPTTExtractor:
         assert "- 噓：1" in result
         assert "user1: 推文內容一" in result
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
     def test_fetch_ptt_content_uses_over18_cookie(self, mock_get):
-        response = MagicMock()
-        response.raise_for_status = MagicMock()
-        response.text = self.SAMPLE_HTML
-        mock_get.return_value = response
+        mock_get.return_value = FakeResponse(text=self.SAMPLE_HTML)
 
         content, extractor = main.fetch_ptt_content("https://www.ptt.cc/bbs/Gossiping/M.123.A.456.html")
 
@@ -1659,12 +2026,9 @@ class Test104Extractor:
         assert "請附上作品集" in result
         assert "## 福利制度" in result
 
-    @patch("main.requests.get")
+    @patch("main.http_session.get")
     def test_fetch_104_content_uses_ajax_endpoint(self, mock_get):
-        response = MagicMock()
-        response.raise_for_status = MagicMock()
-        response.json.return_value = self.SAMPLE_PAYLOAD
-        mock_get.return_value = response
+        mock_get.return_value = FakeResponse(json_data=self.SAMPLE_PAYLOAD)
 
         content, extractor = main.fetch_104_content("https://www.104.com.tw/job/6m2k2")
 
@@ -1725,134 +2089,88 @@ class Test104Extractor:
 class TestFormatGoogleMapsResult:
     """測試 Google Maps 爬蟲結果格式化"""
 
-    def test_format_full_place_data(self):
-        """完整地點資料格式化"""
-        place = {
-            "title": "東京拉麵店",
-            "categoryName": "拉麵店",
-            "address": "東京都新宿區1-2-3",
-            "totalScore": 4.5,
-            "reviewsCount": 120,
-            "phone": "+81-3-1234-5678",
-            "website": "https://ramen.example.com",
-            "price": "$$",
-        }
-        result = main.format_google_maps_result(place)
-        assert "東京拉麵店" in result
-        assert "拉麵店" in result
-        assert "東京都新宿區1-2-3" in result
-        assert "4.5" in result
-        assert "120" in result
-        assert "+81-3-1234-5678" in result
-        assert "https://ramen.example.com" in result
-        assert "$$" in result
-
-    def test_format_minimal_place_data(self):
-        """最少資料的地點格式化"""
-        place = {
-            "title": "某地點",
-        }
-        result = main.format_google_maps_result(place)
-        assert "某地點" in result
-        assert "地點名稱" in result
-
-    def test_format_with_name_field(self):
-        """使用 name 欄位而非 title"""
-        place = {
-            "name": "備用名稱店",
-        }
-        result = main.format_google_maps_result(place)
-        assert "備用名稱店" in result
-
-    def test_format_with_opening_hours_list(self):
-        """營業時間為列表格式"""
-        place = {
-            "title": "Test Place",
-            "openingHours": [
-                {"day": "Monday", "hours": "9:00-21:00"},
-                {"day": "Tuesday", "hours": "9:00-21:00"},
-            ],
-        }
-        result = main.format_google_maps_result(place)
-        assert "Monday" in result
-        assert "9:00-21:00" in result
-
-    def test_format_with_opening_hours_string_list(self):
-        """營業時間為字串列表格式"""
-        place = {
-            "title": "Test Place",
-            "openingHours": ["Mon: 9-21", "Tue: 9-21"],
-        }
-        result = main.format_google_maps_result(place)
-        assert "Mon: 9-21" in result
-
-    def test_format_with_opening_hours_string(self):
-        """營業時間為單一字串"""
-        place = {
-            "title": "Test Place",
-            "openingHours": "Mon-Fri 9:00-21:00",
-        }
-        result = main.format_google_maps_result(place)
-        assert "Mon-Fri 9:00-21:00" in result
-
-    def test_format_with_coordinates(self):
-        """包含座標資訊"""
-        place = {
-            "title": "Test Place",
-            "location": {"lat": 35.6762, "lng": 139.6503},
-        }
-        result = main.format_google_maps_result(place)
-        assert "35.6762" in result
-        assert "139.6503" in result
-
-    def test_format_with_description(self):
-        """包含簡介"""
-        place = {
-            "title": "Test Place",
-            "description": "一家很棒的餐廳",
-        }
-        result = main.format_google_maps_result(place)
-        assert "一家很棒的餐廳" in result
-
-    def test_format_empty_place(self):
-        """空資料應回傳未知地點"""
-        place = {}
-        result = main.format_google_maps_result(place)
-        assert "未知地點" in result
-
-    def test_format_with_rating_field(self):
-        """使用 rating 欄位而非 totalScore"""
-        place = {
-            "title": "Test",
-            "rating": 4.2,
-            "reviews": 50,
-        }
-        result = main.format_google_maps_result(place)
-        assert "4.2" in result
-        assert "50" in result
-
-    def test_format_with_place_url_status_and_reviews(self):
-        place = {
-            "title": "Test Cafe",
-            "placeUrl": "https://maps.google.com/?cid=123",
-            "temporarilyClosed": True,
-            "plusCode": "3JH7+P4",
-            "reviewsDistribution": {"5": 10, "4": 2},
-            "reviews": [
-                {
-                    "name": "Amy",
-                    "stars": 5,
-                    "publishedAtDate": "2026-05-01",
-                    "text": "咖啡很好喝",
-                }
-            ],
-        }
+    @pytest.mark.parametrize("place, expected", [
+        pytest.param(
+            {
+                "title": "東京拉麵店",
+                "categoryName": "拉麵店",
+                "address": "東京都新宿區1-2-3",
+                "totalScore": 4.5,
+                "reviewsCount": 120,
+                "phone": "+81-3-1234-5678",
+                "website": "https://ramen.example.com",
+                "price": "$$",
+            },
+            ["東京拉麵店", "拉麵店", "東京都新宿區1-2-3", "4.5", "120", "+81-3-1234-5678",
+             "https://ramen.example.com", "$$"],
+            id="full_place_data",
+        ),
+        # 最少資料的地點格式化
+        pytest.param({"title": "某地點"}, ["某地點", "地點名稱"], id="minimal_place_data"),
+        # 使用 name 欄位而非 title
+        pytest.param({"name": "備用名稱店"}, ["備用名稱店"], id="name_field"),
+        # 營業時間為列表格式
+        pytest.param(
+            {
+                "title": "Test Place",
+                "openingHours": [
+                    {"day": "Monday", "hours": "9:00-21:00"},
+                    {"day": "Tuesday", "hours": "9:00-21:00"},
+                ],
+            },
+            ["Monday", "9:00-21:00"],
+            id="opening_hours_list",
+        ),
+        # 營業時間為字串列表格式
+        pytest.param(
+            {"title": "Test Place", "openingHours": ["Mon: 9-21", "Tue: 9-21"]},
+            ["Mon: 9-21"],
+            id="opening_hours_string_list",
+        ),
+        # 營業時間為單一字串
+        pytest.param(
+            {"title": "Test Place", "openingHours": "Mon-Fri 9:00-21:00"},
+            ["Mon-Fri 9:00-21:00"],
+            id="opening_hours_string",
+        ),
+        # 包含座標資訊
+        pytest.param(
+            {"title": "Test Place", "location": {"lat": 35.6762, "lng": 139.6503}},
+            ["35.6762", "139.6503"],
+            id="coordinates",
+        ),
+        # 包含簡介
+        pytest.param({"title": "Test Place", "description": "一家很棒的餐廳"}, ["一家很棒的餐廳"], id="description"),
+        # 空資料應回傳未知地點
+        pytest.param({}, ["未知地點"], id="empty_place"),
+        # 使用 rating 欄位而非 totalScore
+        pytest.param({"title": "Test", "rating": 4.2, "reviews": 50}, ["4.2", "50"], id="rating_field"),
+        pytest.param(
+            {
+                "title": "Test Cafe",
+                "placeUrl": "https://maps.google.com/?cid=123",
+                "temporarilyClosed": True,
+                "plusCode": "3JH7+P4",
+                "reviewsDistribution": {"5": 10, "4": 2},
+                "reviews": [
+                    {
+                        "name": "Amy",
+                        "stars": 5,
+                        "publishedAtDate": "2026-05-01",
+                        "text": "咖啡很好喝",
+                    }
+                ],
+            },
+            ["Google Maps URL：https://maps.google.com/?cid=123", "暫停營業", "Plus Code：3JH7+P4",
+             "評論分布", "Amy，5/5，2026-05-01：咖啡很好喝"],
+            id="place_url_status_and_reviews",
+        ),
+    ])
+    def test_format_place(self, place, expected):
+        """地點資料格式化後應包含各欄位內容"""
         result = main.format_google_maps_result(place)
-        assert "Google Maps URL：https://maps.google.com/?cid=123" in result
-        assert "暫停營業" in result
-        assert "Plus Code：3JH7+P4" in result
-        assert "評論分布" in result
-        assert "Amy，5/5，2026-05-01：咖啡很好喝" in result
+        missing = [text for text in expected if text not in result]
+        assert not missing, missing
 
     def test_assess_google_maps_full_place(self):
         place = {
@@ -1893,17 +2211,19 @@ class TestConstants:
     def test_timeout_is_5_minutes(self):
         assert main.TRANSLATION_MODE_TIMEOUT == 300
 
-    def test_hallucination_patterns_not_empty(self):
-        assert len(main.HALLUCINATION_PATTERNS) > 0
-
-    def test_language_map_not_empty(self):
-        assert len(main.LANGUAGE_MAP) > 0
+    def test_shared_constants_are_read_only(self):
+        """共用常數不可被修改（避免測試或請求之間互相污染）"""
+        assert isinstance(main.HALLUCINATION_PATTERNS, tuple)
+        assert isinstance(main.QUICK_REPLY_LANGUAGES, tuple)
+        with pytest.raises(TypeError):
+            main.LANGUAGE_MAP["測試文"] = "Test"
 
     def test_quick_reply_languages_format(self):
-        for item in main.QUICK_REPLY_LANGUAGES:
-            assert len(item) == 2
-            assert isinstance(item[0], str)  # Chinese label
-            assert isinstance(item[1], str)  # English code
+        # (中文標籤, 英文代碼) 皆為字串的二元組
+        assert all(
+            len(item) == 2 and isinstance(item[0], str) and isinstance(item[1], str)
+            for item in main.QUICK_REPLY_LANGUAGES
+        ), main.QUICK_REPLY_LANGUAGES
 
 
 # ============================================================
@@ -1918,31 +2238,51 @@ class TestEdgeCases:
         result = main.extract_url(text)
         assert result is not None
 
-    def test_normalize_facebook_with_string_numbers(self):
-        """數字可能以字串形式出現"""
+    @pytest.mark.parametrize("raw, expected", [
+        ("100", 100),
+        (100, 100),
+        (100.0, 100),
+        ("1,234", 1234),
+        ("1.2K", 1200),
+        (None, 0),
+        ("abc", 0),
+    ])
+    def test_normalize_facebook_numbers(self, raw, expected):
+        """數字可能以字串、浮點數、縮寫或缺值形式出現"""
         post = {
             "pageName": "Test",
             "text": "content",
-            "likes": "100",
-            "comments": "50",
-            "shares": "25",
+            "likes": raw,
+            "comments": raw,
+            "shares": raw,
         }
         result = main.normalize_social_post_data(post, "facebook")
-        assert result["likes"] == 100
-        assert result["comments"] == 50
-        assert result["shares"] == 25
+        assert (result["likes"], result["comments"], result["shares"]) == (expected, expected, expected)
+
+    @pytest.mark.parametrize("keywords, expected", [
+        ("AI、ML、DL", ["AI", "ML", "DL"]),
+        ("AI,ML,DL", ["AI", "ML", "DL"]),
+        ("AI，ML，DL", ["AI", "ML", "DL"]),
+        ("AI、機器學習,深度學習，自然語言處理", ["AI", "機器學習", "深度學習", "自然語言處理"]),
+    ], ids=["enumeration_comma", "ascii_comma", "fullwidth_comma", "mixed"])
+    def test_parse_keywords_with_different_separators(self, keywords, expected):
+        result = main.parse_summary_response(f"🔑 關鍵字：{keywords}")
+        assert result["keywords"] == expected
+
+    @patch.dict(main.gdrive_folder_cache, clear=True)
+    def test_long_title_truncated_in_filename(self, monkeypatch):
+        """超長標題存入 Google Drive 時檔名只取前 30 字，內文保留完整標題"""
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", "root")
+        service = MagicMock()
+        service.files.return_value.list.return_value.execute.return_value = {"files": [{"id": "folder"}]}
+        service.files.return_value.create.return_value.execute.return_value = {"id": "file1"}
+        long_title = "A" * 200
 
-    def test_parse_keywords_with_different_separators(self):
-        response = "🔑 關鍵字：AI、機器學習,深度學習，自然語言處理"
-        result = main.parse_summary_response(response)
-        assert len(result["keywords"]) >= 3
+        main.save_to_gdrive(title=long_title, content_type="筆記", category="其他", content="c", service=service)
 
-    def test_long_content_truncation(self):
-        """測試超長文字在 Notion 儲存時被截斷"""
-        long_title = "A" * 200
-        # Title should be truncated at 100
-        truncated = long_title[:100]
-        assert len(truncated) == 100
+        kwargs = service.files.return_value.create.call_args.kwargs
+        assert kwargs["body"]["name"].endswith("-筆記-" + "A" * 30 + ".md")
+        assert f"# {long_title}" in kwargs["media_body"].getbytes(0, kwargs["media_body"].size()).decode("utf-8")
 
 
 # ============================================================
@@ -2201,32 +2541,32 @@ class TestImageAnalysis:
 
     def test_analyze_image_without_openai(self):
         """OpenAI 未設定時應回傳錯誤訊息"""
-        original_client = main.openai_client
-        main.openai_client = None
-
         result = main.analyze_image(b"fake image data")
         assert "圖片分析功能未設定" in result
 
-        main.openai_client = original_client
-
     def test_translate_image_text_without_openai(self):
         """OpenAI 未設定時應回傳錯誤訊息"""
-        original_client = main.openai_client
-        main.openai_client = None
-
         result = main.translate_image_text(b"fake image data", "English")
         assert "圖片翻譯功能未設定" in result
 
-        main.openai_client = original_client
+    @patch("main.line_blob_api")
+    @patch("main.background_executor")
+    @patch("main.openai_client", new=MagicMock())
+    @patch("main.line_messaging_api")
+    def test_image_handled_in_background(self, _mock_api, mock_executor, mock_blob):
+        """下載與 Vision 分析都交給背景執行"""
+        event = SimpleNamespace(reply_token="token", message=SimpleNamespace(id="m1"),
+                                source=SimpleNamespace(type="user", user_id="user1"))
+        with patch.dict(main.user_pending_last_file, clear=True):
+            main.handle_image_message(event)
+        mock_blob.get_message_content.assert_not_called()
+        mock_executor.submit.assert_called_once_with(main.process_image_message, event)
 
     @patch("main.openai_client")
     def test_analyze_image_success(self, mock_client):
         """測試圖片分析正常回傳"""
         main.openai_client = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = "🏷️ 分類：照片\n\n📝 圖片描述：Test image"
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create.return_value = chat_completion("🏷️ 分類：照片\n\n📝 圖片描述：Test image")
 
         result = main.analyze_image(b"fake image data")
         assert "Test image" in result
@@ -2244,10 +2584,7 @@ class TestImageAnalysis:
     def test_translate_image_text_success(self, mock_client):
         """測試圖片翻譯正常回傳"""
         main.openai_client = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = "📖 原始文字：你好\n\n🌐 翻譯結果：Hello"
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create.return_value = chat_completion("📖 原始文字：你好\n\n🌐 翻譯結果：Hello")
 
         result = main.translate_image_text(b"fake image data", "English")
         assert "Hello" in result
@@ -2258,22 +2595,179 @@ class TestImageAnalysis:
         assert ImageMessageContent is not None
 
 
+class TestShowLoadingAnimation:
+    """測試 LINE 讀取動畫"""
+
+    @patch("main.line_messaging_api")
+    def test_one_on_one_chat(self, mock_api):
+        event = SimpleNamespace(source=SimpleNamespace(type="user", user_id="user1"))
+        main.show_loading_animation(event)
+        request = mock_api.show_loading_animation.call_args.args[0]
+        assert request.chat_id == "user1"
+        assert request.loading_seconds == 20
+
+    @patch("main.line_messaging_api")
+    def test_group_chat_skipped(self, mock_api):
+        event = SimpleNamespace(source=SimpleNamespace(type="group", user_id="user1"))
+        main.show_loading_animation(event)
+        mock_api.show_loading_animation.assert_not_called()
+
+    @patch("main.line_messaging_api")
+    def test_api_error_is_swallowed(self, mock_api):
+        mock_api.show_loading_animation.side_effect = Exception("API Error")
+        event = SimpleNamespace(source=SimpleNamespace(type="user", user_id="user1"))
+        main.show_loading_animation(event)
+
+
+class TestReplyOrPush:
+    """測試背景回覆（reply token 過期時改用 push）"""
+
+    def _event(self):
+        return SimpleNamespace(reply_token="token", source=SimpleNamespace(type="user", user_id="user1"))
+
+    @patch("main.line_messaging_api")
+    def test_reply_text_payload_matches_validated_model(self, mock_api):
+        main.reply_text(self._event(), "hi")
+        request = mock_api.reply_message_with_http_info.call_args.args[0]
+        expected = main.ReplyMessageRequest(reply_token="token", messages=[main.TextMessage(text="hi")])
+        assert request.to_dict() == expected.to_dict()
+
+    @patch("main.line_messaging_api")
+    def test_reply_token_used_first(self, mock_api):
+        main.reply_or_push(self._event(), [main.TextMessage(text="hi")])
+        mock_api.reply_message_with_http_info.assert_called_once()
+        mock_api.push_message.assert_not_called()
+
+    @patch("main.line_messaging_api")
+    def test_expired_token_falls_back_to_push(self, mock_api):
+        mock_api.reply_message_with_http_info.side_effect = main.ApiException(status=400)
+        main.reply_or_push(self._event(), [main.TextMessage(text="hi")])
+        request = mock_api.push_message.call_args.args[0]
+        assert request.to == "user1"
+
+    @pytest.mark.parametrize("source, expected", [
+        (SimpleNamespace(type="group", group_id="group1", user_id="user1"), "group1"),
+        (SimpleNamespace(type="room", room_id="room1", user_id="user1"), "room1"),
+    ])
+    @patch("main.line_messaging_api")
+    def test_push_goes_to_group_or_room(self, mock_api, source, expected):
+        mock_api.reply_message_with_http_info.side_effect = main.ApiException(status=400)
+        event = SimpleNamespace(reply_token="token", source=source)
+        main.reply_or_push(event, [main.TextMessage(text="hi")])
+        request = mock_api.push_message.call_args.args[0]
+        assert request.to == expected
+
+    @patch("main.background_executor")
+    @patch("main.openai_client", new=MagicMock())
+    @patch("main.line_messaging_api")
+    def test_group_audio_acknowledged_with_text(self, mock_api, mock_executor):
+        event = SimpleNamespace(reply_token="token", message=SimpleNamespace(id="m1"),
+                                source=SimpleNamespace(type="group", group_id="group1", user_id="user1"))
+        main.handle_audio_message(event)
+        request = mock_api.reply_message_with_http_info.call_args.args[0]
+        assert request.messages[0].text == "收到語音，處理中…"
+        mock_api.show_loading_animation.assert_not_called()
+        mock_executor.submit.assert_called_once_with(main.process_audio_message, event)
+
+    @patch("main.line_messaging_api")
+    def test_other_errors_raise(self, mock_api):
+        mock_api.reply_message_with_http_info.side_effect = main.ApiException(status=500)
+        with pytest.raises(main.ApiException):
+            main.reply_or_push(self._event(), [main.TextMessage(text="hi")])
+        mock_api.push_message.assert_not_called()
+
+
+class TestHandleTextMessage:
+    """測試文字訊息指令分派（經過 reply_text 的分支）"""
+
+    def _event(self, text):
+        return SimpleNamespace(
+            reply_token="token",
+            message=SimpleNamespace(text=text),
+            source=SimpleNamespace(type="user", user_id="user1"),
+        )
+
+    @patch("main.background_executor")
+    @patch("main.line_messaging_api")
+    def test_weekly_digest_replies_and_runs_in_background(self, mock_api, mock_executor):
+        main.handle_text_message(self._event("整理本週"))
+        request = mock_api.reply_message_with_http_info.call_args.args[0]
+        assert "開始整理近 7 天" in request.messages[0].text
+        mock_executor.submit.assert_called_once()
+
+    @staticmethod
+    def _run_inline(mock_executor):
+        """讓背景任務在測試中同步執行"""
+        def submit(fn, *args):
+            future = main.Future()
+            future.set_result(fn(*args))
+            return future
+        mock_executor.submit.side_effect = submit
+
+    @patch("main.get_today_files", return_value=[])
+    @patch("main.background_executor")
+    @patch("main.line_messaging_api")
+    def test_today_review_without_files(self, mock_api, mock_executor, _mock_files):
+        self._run_inline(mock_executor)
+        main.handle_text_message(self._event("今日回顧"))
+        request = mock_api.reply_message_with_http_info.call_args.args[0]
+        assert request.messages[0].text == "今天還沒有任何記錄，快去捕捉些什麼吧！"
+
+    @patch("main.queue_gdrive_save")
+    @patch("main.translate_text", return_value="Hello")
+    @patch("main.background_executor")
+    @patch("main.line_messaging_api")
+    def test_translation_runs_in_background(self, mock_api, mock_executor, mock_translate, mock_queue):
+        main.handle_text_message(self._event("翻譯成英文：你好"))
+        mock_translate.assert_not_called()
+
+        task, *args = mock_executor.submit.call_args.args
+        task(*args)
+        request = mock_api.reply_message_with_http_info.call_args.args[0]
+        assert "Hello" in request.messages[0].text
+        mock_queue.assert_called_once()
+
+    @patch("main.save_to_gdrive", return_value="file-1")
+    @patch("main.scrape_threads_post", return_value=[])
+    @patch("main.apify_client", new=MagicMock())
+    @patch("main.background_executor")
+    @patch("main.line_messaging_api")
+    def test_single_social_post_scraped_in_background(self, mock_api, mock_executor, mock_scrape, _mock_save):
+        with patch.dict(main.user_last_file, clear=True), \
+                patch.dict(main.user_pending_last_file, clear=True):
+            main.handle_text_message(self._event("https://www.threads.net/@user/post/ABC123"))
+            mock_scrape.assert_not_called()
+
+            self._run_inline(mock_executor)
+            task, *args = mock_executor.submit.call_args.args
+            main.submit_last_file_task("user1", task, *args)
+
+            assert main.user_last_file["user1"]["file_id"] == "file-1"
+        request = mock_api.reply_message_with_http_info.call_args.args[0]
+        assert "無法爬取 Threads 貼文" in request.messages[0].text
+
+    @patch("main.append_to_gdrive_file")
+    @patch("main.background_executor")
+    @patch("main.line_messaging_api")
+    def test_supplement_runs_in_background(self, mock_api, mock_executor, mock_append):
+        main.handle_text_message(self._event("補充想法：再想想"))
+        mock_append.assert_not_called()
+        mock_api.reply_message_with_http_info.assert_not_called()
+        args = mock_executor.submit.call_args.args
+        assert args[2:] == ("user1", "再想想")
+
+
 class TestParseContactFromText:
     """測試聯絡人自然語言解析"""
 
     def test_parse_contact_without_openai(self):
-        original = main.openai_client
-        main.openai_client = None
         result = main.parse_contact_from_text("Jason 同事")
         assert result is None
-        main.openai_client = original
 
     @patch("main.openai_client")
     def test_parse_contact_success(self, mock_client):
         main.openai_client = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = json.dumps({
+        mock_client.chat.completions.create.return_value = chat_completion(json.dumps({
             "name": "Jason",
             "relation": "同事",
             "company": "ABC 公司",
@@ -2283,8 +2777,7 @@ class TestParseContactFromText:
             "line_id": "",
             "notes": "在 AWS 大會認識",
             "tags": ["AI", "工程師"]
-        })
-        mock_client.chat.completions.create.return_value = mock_response
+        }))
 
         result = main.parse_contact_from_text("Jason 同事 ABC 公司工程師 0912345678 在 AWS 大會認識")
         assert result is not None
@@ -2296,22 +2789,16 @@ class TestParseContactFromText:
     @patch("main.openai_client")
     def test_parse_contact_no_name_returns_none(self, mock_client):
         main.openai_client = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = json.dumps({"name": None})
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create.return_value = chat_completion(json.dumps({"name": None}))
 
         assert main.parse_contact_from_text("一些隨便的文字") is None
 
     @patch("main.openai_client")
     def test_parse_contact_strips_markdown_fences(self, mock_client):
         main.openai_client = mock_client
-        mock_response = MagicMock()
-        mock_response.choices = [MagicMock()]
-        mock_response.choices[0].message.content = (
+        mock_client.chat.completions.create.return_value = chat_completion(
             "```json\n" + json.dumps({"name": "小華", "relation": "朋友", "tags": []}) + "\n```"
         )
-        mock_client.chat.completions.create.return_value = mock_response
         result = main.parse_contact_from_text("小華 是朋友")
         assert result["name"] == "小華"
 
@@ -2319,24 +2806,19 @@ class TestParseContactFromText:
 class TestSaveContactToWiki:
     """測試聯絡人存入 Wiki/People/"""
 
-    def test_save_contact_without_vault_id(self):
-        original = main.GDRIVE_VAULT_FOLDER_ID
-        main.GDRIVE_VAULT_FOLDER_ID = None
+    def test_save_contact_without_vault_id(self, monkeypatch):
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", None)
         result = main.save_contact_to_wiki({"name": "Jason"})
         assert result is None
-        main.GDRIVE_VAULT_FOLDER_ID = original
 
-    def test_save_contact_without_name_returns_none(self):
-        original = main.GDRIVE_VAULT_FOLDER_ID
-        main.GDRIVE_VAULT_FOLDER_ID = "fake_id"
+    def test_save_contact_without_name_returns_none(self, monkeypatch):
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", "fake_id")
         result = main.save_contact_to_wiki({"name": ""})
         assert result is None
-        main.GDRIVE_VAULT_FOLDER_ID = original
 
     @patch("main.save_wiki_page")
-    def test_save_contact_calls_save_wiki_with_people_subfolder(self, mock_save):
-        original = main.GDRIVE_VAULT_FOLDER_ID
-        main.GDRIVE_VAULT_FOLDER_ID = "fake_id"
+    def test_save_contact_calls_save_wiki_with_people_subfolder(self, mock_save, monkeypatch):
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", "fake_id")
         mock_save.return_value = "file_xyz"
 
         contact = {
@@ -2369,12 +2851,9 @@ class TestSaveContactToWiki:
         assert "AWS 認識" in full_content
         assert "互動記錄" in full_content
 
-        main.GDRIVE_VAULT_FOLDER_ID = original
-
     @patch("main.save_wiki_page")
-    def test_save_contact_minimal_fields(self, mock_save):
-        original = main.GDRIVE_VAULT_FOLDER_ID
-        main.GDRIVE_VAULT_FOLDER_ID = "fake_id"
+    def test_save_contact_minimal_fields(self, mock_save, monkeypatch):
+        monkeypatch.setattr(main, "GDRIVE_VAULT_FOLDER_ID", "fake_id")
         mock_save.return_value = "file_id"
 
         result = main.save_contact_to_wiki({"name": "小明"})
@@ -2385,8 +2864,6 @@ class TestSaveContactToWiki:
         assert "**電話**" not in full_content
         assert "**Email**" not in full_content
 
-        main.GDRIVE_VAULT_FOLDER_ID = original
-
 
 class TestAddContactCommandRegex:
     """測試加聯絡人指令的 regex 觸發"""
@@ -2456,31 +2933,24 @@ class TestCronWeeklyEndpoint:
     def setup_method(self):
         self.client = main.app.test_client()
 
-    def test_cron_no_secret_configured(self):
-        original = main.CRON_SECRET
-        main.CRON_SECRET = None
+    def test_cron_no_secret_configured(self, monkeypatch):
+        monkeypatch.setattr(main, "CRON_SECRET", None)
         response = self.client.post("/cron/weekly")
         assert response.status_code == 503
-        main.CRON_SECRET = original
 
-    def test_cron_unauthorized(self):
-        original = main.CRON_SECRET
-        main.CRON_SECRET = "real_secret"
+    def test_cron_unauthorized(self, monkeypatch):
+        monkeypatch.setattr(main, "CRON_SECRET", "real_secret")
         response = self.client.post("/cron/weekly", headers={"X-Cron-Secret": "wrong"})
         assert response.status_code == 401
-        main.CRON_SECRET = original
 
-    def test_cron_unauthorized_no_header(self):
-        original = main.CRON_SECRET
-        main.CRON_SECRET = "real_secret"
+    def test_cron_unauthorized_no_header(self, monkeypatch):
+        monkeypatch.setattr(main, "CRON_SECRET", "real_secret")
         response = self.client.post("/cron/weekly")
         assert response.status_code == 401
-        main.CRON_SECRET = original
 
     @patch("main.run_consolidate_sources")
-    def test_cron_authorized_via_header(self, mock_run):
-        original = main.CRON_SECRET
-        main.CRON_SECRET = "real_secret"
+    def test_cron_authorized_via_header(self, mock_run, monkeypatch):
+        monkeypatch.setattr(main, "CRON_SECRET", "real_secret")
         mock_run.return_value = {
             "month": "2026-04", "total": 5,
             "consolidated": ["AI（3 篇）"], "skipped": []
@@ -2491,28 +2961,23 @@ class TestCronWeeklyEndpoint:
         assert data["status"] == "ok"
         assert data["total_sources"] == 5
         assert data["wiki_pages_created"] == 1
-        main.CRON_SECRET = original
 
     @patch("main.run_consolidate_sources")
-    def test_cron_authorized_via_query_param(self, mock_run):
-        original = main.CRON_SECRET
-        main.CRON_SECRET = "real_secret"
+    def test_cron_authorized_via_query_param(self, mock_run, monkeypatch):
+        monkeypatch.setattr(main, "CRON_SECRET", "real_secret")
         mock_run.return_value = {"month": "2026-04", "total": 0, "consolidated": [], "skipped": []}
         response = self.client.get("/cron/weekly?secret=real_secret")
         assert response.status_code == 200
-        main.CRON_SECRET = original
 
     @patch("main.run_consolidate_sources")
-    def test_cron_handles_internal_error(self, mock_run):
-        original = main.CRON_SECRET
-        main.CRON_SECRET = "real_secret"
+    def test_cron_handles_internal_error(self, mock_run, monkeypatch):
+        monkeypatch.setattr(main, "CRON_SECRET", "real_secret")
         mock_run.side_effect = Exception("boom")
         response = self.client.post("/cron/weekly", headers={"X-Cron-Secret": "real_secret"})
         assert response.status_code == 500
         data = response.get_json()
         assert data["status"] == "error"
         assert "boom" in data["message"]
-        main.CRON_SECRET = original
 
 
 class TestHealthzEndpoint:
@@ -2664,10 +3129,7 @@ class TestDesktopVoiceCapture:
     def test_desktop_voice_translate_transcript(self, _mock_openai, mock_dictionary):
         mock_dictionary.return_value = "Kaku"
         client = MagicMock()
-        response = MagicMock()
-        response.choices = [MagicMock()]
-        response.choices[0].message.content = "This is a test."
-        client.chat.completions.create.return_value = response
+        client.chat.completions.create.return_value = chat_completion("This is a test.")
 
         result = desktop_voice.translate_transcript(client, "這是一個測試", "English", args=SimpleNamespace())
         assert result == "This is a test."